@@ -0,0 +1,1143 @@
+#!/usr/bin/env python3
+"""
+Benchmarks
+Times the scraper's stages on synthetic inputs generated offline.
+
+    python benchmark.py parsers [--rows N] [--tables N] [--depth N] [--repeat N]
+    python benchmark.py render [--width N] [--height N] [--repeat N]
+    python benchmark.py startup [--repeat N] [--top N]
+    python benchmark.py throttle [--docs N] [--server-rate N] [--error-rate P] [--rate N]
+    python benchmark.py batch [--docs N] [--batch-size N] [--retry-after S]
+    python benchmark.py structural [--docs N] [--depth N] [--nesting N] [--seed N]
+    python benchmark.py spans [--tables N] [--rows N] [--cols N] [--seed N]
+    python benchmark.py tiles [--grids N] [--size N] [--seed N]
+    python benchmark.py delta [--rounds N] [--size N] [--seed N]
+    python benchmark.py service [--requests N] [--docs N] [--max-bytes N]
+    python benchmark.py pipeline [--rows N] [--tables N] [--depth N] [--span-every N]
+                                 [--width N] [--height N] [--repeat N] [--output FILE]
+
+The pipeline benchmark runs both the published-doc and the Docs API paths
+stage by stage (fetch with the network stubbed, parse, decode, render) and
+records the best / mean time and the tracemalloc peak of each stage. With
+--output the results are appended to FILE as JSON lines.
+
+The throttle benchmark serves synthetic docs from a local stub HTTP server
+that enforces a request quota (429 + Retry-After) and fails a fraction of
+requests with 503, then fetches them with and without the fetch scheduler.
+It fails unless the scheduler gets every doc and never retries a doc sooner
+than the Retry-After it was sent.
+
+The batch check runs fetch_documents through a real Docs v1 service object
+over a fake multipart transport, and fails unless every request carries the
+field mask and throttled requests go round again after their Retry-After.
+
+The remaining checks compare an optimised path with a plain reference on
+random inputs and fail on the first difference:
+    structural   read_structural_elements vs the recursive walk it replaced,
+                 plus a document nested far past the recursion limit
+    spans        TableBuilder, bs4 and the streaming parsers vs a plain
+                 dict-of-positions layout of rowspan / colspan
+    tiles        MosaicGrid's full, windowed and tiled output vs a renderer
+                 that walks every column of every row
+    delta        mosaic_delta's stored and patched lines vs a full render
+                 after each round of random edits
+    service      mosaic_service: one fetch for a burst of requests, LRU byte
+                 bound after views are built, TTL expiry, malformed IDs
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from html_tables import available_backends, parse_html
+from mosaic_grid import MosaicGrid, decode_mosaic_rows
+from mosaic_render import render_rows
+
+GLYPHS = '█░▀▄'
+
+
+HEADERS = ('x-coordinate', 'Character', 'y-coordinate')
+
+
+def synthetic_rows(rows, width=None, height=None, span_every=0, rng=None):
+    """
+    Yield (x, glyph, y, rowspan) rows; coordinates fall in [0, width) x
+    [0, height) (default: [0, rows) on both axes). With span_every > 0
+    every span_every-th row carries a note cell spanning two rows.
+    """
+    rng = rng or random.Random(0)
+    width = width or rows
+    height = height or rows
+    for i in range(rows):
+        rowspan = 2 if span_every and i % span_every == 0 and i + 1 < rows else 0
+        yield rng.randrange(width), rng.choice(GLYPHS), rng.randrange(height), rowspan
+
+
+def synthetic_published_doc(rows=10000, tables=1, seed=0, depth=0, span_every=0, width=None, height=None):
+    """
+    Build HTML shaped like a 'Published to web' Google Doc: styled
+    paragraphs around tables of (x, glyph, y) rows, each cell wrapped in
+    <p><span> the way Docs exports them. Each table sits inside depth
+    single-cell layout tables; span_every adds a rowspan=2 note column.
+    """
+    rng = random.Random(seed)
+
+    def cell(value, rowspan=1):
+        return f'<td class="c5" colspan="1" rowspan="{rowspan}"><p class="c1"><span class="c2">{value}</span></p></td>'
+
+    parts = ['<html><head><meta content="text/html; charset=UTF-8" http-equiv="content-type">'
+             '<style type="text/css">.c1{padding:5pt}.c2{font-weight:400}</style></head>'
+             '<body class="c7"><p class="c4"><span class="c2">Mosaic data</span></p>']
+    for _ in range(tables):
+        parts.append('<table class="c8"><tr class="c3"><td class="c5">' * depth)
+        parts.append('<table class="c9">')
+        parts.append('<tr class="c3">')
+        for header in HEADERS + (('Note',) if span_every else ()):
+            parts.append(cell(header))
+        parts.append('</tr>')
+        for x, glyph, y, rowspan in synthetic_rows(rows, width, height, span_every, rng):
+            parts.append('<tr class="c3">')
+            for value in (x, glyph, y):
+                parts.append(cell(value))
+            if rowspan:
+                parts.append(cell('merged', rowspan))
+            parts.append('</tr>')
+        parts.append('</table>')
+        parts.append('</td></tr></table>' * depth)
+        parts.append('<p class="c4 c6"><span class="c2"></span></p>')
+    parts.append('</body></html>')
+    return ''.join(parts).encode('utf-8')
+
+
+def synthetic_docs_api_document(rows=10000, tables=1, seed=0, depth=0, span_every=0, width=None, height=None):
+    """
+    Build a Docs API documents.get body with the same tables as
+    synthetic_published_doc: cell text as textRuns ending in a newline,
+    merged cells as rowSpan styles with the covered cell still listed.
+    """
+    rng = random.Random(seed)
+
+    def cell(text, rowspan=None):
+        content = {'content': [{'paragraph': {'elements': [{'textRun': {'content': f"{text}\n"}}]}}]}
+        if rowspan:
+            content['tableCellStyle'] = {'rowSpan': rowspan, 'columnSpan': 1}
+        return content
+
+    def table(table_rows):
+        return {'table': {'tableRows': [{'tableCells': cells} for cells in table_rows]}}
+
+    content = [{'sectionBreak': {}}, {'paragraph': {'elements': [{'textRun': {'content': "Mosaic data\n"}}]}}]
+    for _ in range(tables):
+        headers = HEADERS + (('Note',) if span_every else ())
+        table_rows = [[cell(header) for header in headers]]
+        covered = False
+        for x, glyph, y, rowspan in synthetic_rows(rows, width, height, span_every, rng):
+            cells = [cell(x), cell(glyph), cell(y)]
+            if span_every:
+                cells.append(cell('merged', rowspan) if rowspan else cell('' if covered else 'note'))
+            covered = bool(rowspan)
+            table_rows.append(cells)
+        element = table(table_rows)
+        for _ in range(depth):
+            element = table([[{'content': [element]}]])
+        content.append(element)
+    return {'title': 'Synthetic mosaic', 'revisionId': f'synthetic-{seed}', 'body': {'content': content}}
+
+
+def best_time(func, repeat):
+    """Run func repeat times; return (best seconds, last result)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def measure(func, repeat):
+    """
+    Time func repeat times, then run it once more under tracemalloc.
+    Returns (best seconds, mean seconds, peak bytes, result).
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    # a separate run, so tracing overhead stays out of the timings
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), sum(times) / len(times), peak, result
+
+
+def is_mosaic_table(table):
+    """True for a coordinate table (not a layout table wrapped around one)"""
+    return bool(table) and bool(table[0]) and table[0][0].strip() == HEADERS[0]
+
+
+def unthrottled_scheduler():
+    """A FetchScheduler without rate limits, so stubbed fetches time only the code under test"""
+    from fetch_scheduler import FetchScheduler
+    return FetchScheduler(rate=1e9, burst=10 ** 9)
+
+
+def stub_fetcher(body):
+    """A DocFetcher whose session answers every GET with body, without a network"""
+    from requests import Response
+    from requests.adapters import BaseAdapter
+
+    from doc_fetch import DocFetcher
+
+    class StubAdapter(BaseAdapter):
+        def send(self, request, **kwargs):
+            response = Response()
+            response.status_code = 200
+            response.headers['Content-Type'] = 'text/html; charset=utf-8'
+            response.encoding = 'utf-8'
+            response.raw = io.BytesIO(body)
+            response.url = request.url
+            response.request = request
+            return response
+
+        def close(self):
+            pass
+
+    # no table cache - every run goes through the (stubbed) fetch and parse
+    fetcher = DocFetcher(cache=None, scheduler=unthrottled_scheduler())
+    fetcher.session.mount('https://', StubAdapter())
+    return fetcher
+
+
+class StubDocsService:
+    """Stands in for the Docs v1 service: documents().get().execute() decodes a JSON body"""
+
+    def __init__(self, body):
+        self.body = body
+
+    def documents(self):
+        return self
+
+    def get(self, documentId, fields=None):
+        return self
+
+    def execute(self):
+        return json.loads(self.body)
+
+
+def pipeline_published(args, devnull):
+    """Stages of the published-doc path: yields (stage, variant, func, counter)"""
+    from gdoc_scrape_0 import parse_html_tables
+
+    html = synthetic_published_doc(args.rows, args.tables, depth=args.depth,
+                                   span_every=args.span_every, width=args.width, height=args.height)
+    url = f"https://docs.google.com/document/d/e/benchPipeline{os.getpid()}/pub"
+    yield 'input', None, None, {'bytes': len(html)}
+
+    fetcher = stub_fetcher(html)
+    # the body only - parsing is the next stage
+    yield 'fetch', 'stubbed', lambda: fetcher.fetch_tables('benchPipeline', url, lambda r: r.content), None
+
+    yield 'parse', 'bs4', lambda: parse_html_tables(html), None
+    for backend in available_backends():
+        yield 'parse', backend, lambda backend=backend: parse_html(html, backend=backend), None
+    tables = [table for table in parse_html(html) if is_mosaic_table(table)]
+
+    def decode():
+        return [MosaicGrid.from_cells(decode_mosaic_rows(table)) for table in tables]
+    yield 'decode', None, decode, {'tables': len(tables), 'rows': sum(len(t) for t in tables)}
+
+    # render the grids decode built, as display_table_info does after decoding
+    grids = decode()
+
+    def render():
+        for grid in grids:
+            render_rows(grid.iter_rows(), devnull.buffer)
+    yield 'render', None, render, None
+
+
+def pipeline_docs_api(args, devnull):
+    """Stages of the Docs API path: yields (stage, variant, func, counter)"""
+    from decode_doc import decode_tables, fetch_document, read_structural_elements
+
+    body = json.dumps(synthetic_docs_api_document(
+        args.rows, args.tables, depth=args.depth,
+        span_every=args.span_every, width=args.width, height=args.height))
+    service = StubDocsService(body)
+    scheduler = unthrottled_scheduler()
+    yield 'input', None, None, {'bytes': len(body.encode('utf-8'))}
+
+    yield 'fetch', 'stubbed', lambda: fetch_document(service, 'benchPipeline', scheduler=scheduler), None
+
+    content = fetch_document(service, 'benchPipeline', scheduler=scheduler)['body']['content']
+    yield 'parse', None, lambda: read_structural_elements(content), None
+
+    tables = [table for table in read_structural_elements(content)[1] if is_mosaic_table(table)]
+
+    def decode():
+        # draw_matrix builds the grid under its 'decode' stage too
+        return [MosaicGrid.from_dict(mosaic) for mosaic, _ in decode_tables(tables)]
+    yield 'decode', None, decode, {'tables': len(tables), 'rows': sum(len(t) for t in tables)}
+
+    grids = decode()
+
+    def render():
+        for grid in grids:
+            render_rows(grid.iter_rows(sep=''), devnull.buffer, end='\n\n')
+    yield 'render', None, render, None
+
+
+def bench_pipeline(args):
+    """Time and memory-profile each stage of both scrape paths"""
+    params = {
+        'rows': args.rows, 'tables': args.tables, 'depth': args.depth,
+        'span_every': args.span_every, 'width': args.width, 'height': args.height,
+    }
+    results = []
+    with open(os.devnull, 'w', encoding='utf-8') as devnull:
+        for suite, stages in (('published', pipeline_published), ('docs_api', pipeline_docs_api)):
+            counts = {}
+            for stage, variant, func, counter in stages(args, devnull):
+                counts.update(counter or {})
+                if func is None:
+                    continue
+                best, mean, peak, _ = measure(func, args.repeat)
+                results.append({
+                    'suite': suite, 'stage': stage, 'variant': variant,
+                    'best_s': best, 'mean_s': mean, 'peak_bytes': peak,
+                    'repeat': args.repeat, 'params': params, 'counts': dict(counts),
+                })
+
+    for result in results:
+        name = result['stage'] + (f" ({result['variant']})" if result['variant'] else '')
+        print(f"{result['suite']:<10} {name:<24} {result['best_s']:8.4f}s best  "
+              f"{result['mean_s']:8.4f}s mean  {result['peak_bytes'] / 1e6:8.1f} MB peak")
+
+    if args.output:
+        timestamp = time.time()
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(dict(result, timestamp=timestamp)) + '\n')
+        print(f"Results appended to {args.output}")
+
+
+def stub_doc_server(body, rate, error_rate, retry_after, seed=0):
+    """
+    Start a local HTTP server answering every GET with body, except that
+    requests over rate per second get 429 + Retry-After and error_rate of the
+    rest get 503. Returns (server, stats); stats also has 'arrivals', path ->
+    [(time.monotonic() on arrival, status), ...]. Stop it with server.shutdown().
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from fetch_scheduler import TokenBucket
+
+    quota = TokenBucket(rate, burst=max(1, int(rate)))
+    rng = random.Random(seed)
+    stats = {'ok': 0, '429': 0, '503': 0, 'arrivals': {}}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                now = time.monotonic()
+                quota._refill(now)
+                if quota._tokens < 1:
+                    status = 429
+                else:
+                    quota._tokens -= 1
+                    status = 503 if rng.random() < error_rate else 200
+                stats[str(status) if status != 200 else 'ok'] += 1
+                stats['arrivals'].setdefault(self.path, []).append((now, status))
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', str(retry_after))
+            payload = body if status == 200 else b''
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def bench_throttle(args):
+    """Fetch many docs from a quota-enforcing stub server, with and without retries"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from doc_fetch import DocFetcher
+    from fetch_scheduler import FetchScheduler, RetryPolicy
+
+    body = synthetic_published_doc(args.rows)
+    runs = (
+        # one attempt and no client-side limit: how fetches behaved before
+        ('no retries', FetchScheduler(rate=1e9, burst=10 ** 9, concurrency=args.workers,
+                                      policy=RetryPolicy(attempts=1))),
+        ('scheduler', FetchScheduler(rate=args.rate, burst=max(1, int(args.rate)), concurrency=args.workers,
+                                     policy=RetryPolicy(attempts=args.attempts, base_delay=0.05))),
+    )
+    for name, scheduler in runs:
+        server, stats = stub_doc_server(body, args.server_rate, args.error_rate, args.retry_after)
+        fetcher = DocFetcher(pool_size=args.workers, cache=None, scheduler=scheduler)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+
+        def fetch(i):
+            try:
+                fetcher.fetch_tables(f"doc{i}", f"{base}/doc{i}", lambda response: parse_html(response.content))
+                return True
+            except Exception:
+                return False
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            ok = sum(pool.map(fetch, range(args.docs)))
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+
+        print(f"{name:<12} {ok:5d}/{args.docs} docs  {elapsed:7.2f}s  {ok / elapsed:7.1f} docs/s  "
+              f"server: {stats['ok']} ok, {stats['429']} x 429, {stats['503']} x 503")
+
+    # the last run is the scheduler's: it must get every doc, and never
+    # send a doc's retry before the Retry-After its 429 asked for
+    assert ok == args.docs, f"scheduler fetched {ok} of {args.docs} docs"
+    retry_after = float(args.retry_after)
+    for path, arrivals in stats['arrivals'].items():
+        for (sent, status), (retried, _) in zip(arrivals, arrivals[1:]):
+            assert status != 429 or retried - sent >= retry_after, (
+                f"{path} retried {retried - sent:.3f}s after a 429 with Retry-After {retry_after}s")
+    print(f"ok: every doc fetched, Retry-After honoured on {stats['429']} throttled request(s)")
+
+
+class FakeBatchTransport:
+    """
+    Stands in for the httplib2 transport under a Docs v1 service: answers
+    each multipart batch POST part by part, recording what was asked for.
+    Documents in throttled get one 429 + Retry-After before being served;
+    documents in missing always get a 404.
+    """
+
+    def __init__(self, throttled=(), missing=(), retry_after=1):
+        self.throttled = set(throttled)
+        self.missing = set(missing)
+        self.retry_after = retry_after
+        # per batch, [(document_id, fields), ...] and when it arrived
+        self.batches = []
+        self.batch_times = []
+
+    def _answer(self, document_id):
+        if document_id in self.missing:
+            return '404 Not Found', {}, {'error': {'code': 404, 'message': 'not found'}}
+        if document_id in self.throttled:
+            self.throttled.discard(document_id)
+            return ('429 Too Many Requests', {'Retry-After': str(self.retry_after)},
+                    {'error': {'code': 429, 'message': 'quota exceeded'}})
+        document = synthetic_docs_api_document(rows=3)
+        return '200 OK', {}, dict(document, title=document_id, revisionId=f"rev-{document_id}")
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        import email.parser
+        from urllib.parse import parse_qs, unquote, urlsplit
+
+        import httplib2
+
+        content_type = {k.lower(): v for k, v in (headers or {}).items()}['content-type']
+        message = email.parser.Parser().parsestr(f"content-type: {content_type}\r\n\r\n{body}")
+        batch = []
+        parts = []
+        for part in message.get_payload():
+            request_line = part.get_payload().split('\n', 1)[0]
+            url = urlsplit(request_line.split(' ')[1])
+            document_id = unquote(url.path.rsplit('/', 1)[1])
+            batch.append((document_id, parse_qs(url.query).get('fields', [None])[0]))
+            status, extra_headers, payload = self._answer(document_id)
+            response_headers = ''.join(f"{name}: {value}\r\n" for name, value in extra_headers.items())
+            parts.append(
+                f"Content-Type: application/http\r\nContent-ID: {part['Content-ID']}\r\n\r\n"
+                f"HTTP/1.1 {status}\r\nContent-Type: application/json; charset=UTF-8\r\n{response_headers}\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        self.batches.append(batch)
+        self.batch_times.append(time.monotonic())
+
+        boundary = 'batch_bench'
+        content = ''.join(f"--{boundary}\r\n{part}" for part in parts) + f"--{boundary}--\r\n"
+        response = httplib2.Response({'status': 200, 'content-type': f"multipart/mixed; boundary={boundary}"})
+        return response, content.encode('utf-8')
+
+
+def bench_batch(args):
+    """Check fetch_documents' batch path against a fake multipart transport"""
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+
+    from decode_doc import DOCUMENT_FIELDS, document_size, fetch_documents
+    from fetch_scheduler import FetchScheduler, RetryPolicy
+    from metrics import configure_metrics
+
+    # counters only; nothing worth keeping is written
+    metrics = configure_metrics(os.devnull)
+    document_ids = [f"doc{i}" for i in range(args.docs)]
+    throttled = document_ids[1::3]
+    missing = document_ids[-1:]
+    transport = FakeBatchTransport(throttled, missing, args.retry_after)
+    service = build('docs', 'v1', http=transport, static_discovery=True)
+    scheduler = FetchScheduler(rate=1e9, burst=10 ** 9, policy=RetryPolicy(base_delay=0.01))
+
+    start = time.perf_counter()
+    results = fetch_documents(service, document_ids, batch_size=args.batch_size, scheduler=scheduler)
+    elapsed = time.perf_counter() - start
+
+    requested = [request for batch in transport.batches for request in batch]
+    assert all(fields == DOCUMENT_FIELDS for _, fields in requested), "a request went out without the field mask"
+    assert all(len(batch) <= args.batch_size for batch in transport.batches), "a batch is over batch_size"
+    first_round = -(-len(document_ids) // args.batch_size)
+    retried = [document_id for batch in transport.batches[first_round:] for document_id, _ in batch]
+    assert sorted(retried) == sorted(throttled), f"retry round sent {retried}, expected {throttled}"
+    waited = transport.batch_times[first_round] - transport.batch_times[first_round - 1]
+    assert waited >= args.retry_after, f"retry round sent {waited:.3f}s after a 429 with Retry-After {args.retry_after}s"
+    assert set(results) == set(document_ids), "a document has no result"
+    for document_id in missing:
+        assert isinstance(results[document_id], HttpError) and results[document_id].resp.status == 404
+    for document_id in set(document_ids) - set(missing):
+        assert results[document_id]['title'] == document_id, f"{document_id}: {results[document_id]!r}"
+    fetched_bytes = sum(document_size(results[document_id]) for document_id in set(document_ids) - set(missing))
+    assert metrics.counters.get('bytes_fetched') == fetched_bytes, (
+        f"bytes_fetched {metrics.counters.get('bytes_fetched')}, expected {fetched_bytes}")
+
+    print(f"{len(document_ids)} docs in {len(transport.batches)} batches ({len(requested)} requests, "
+          f"{len(retried)} retried after 429, {len(missing)} x 404)  {elapsed:.3f}s")
+    print(f"ok: field mask on every request, Retry-After {args.retry_after}s honoured before the retry round, "
+          f"{fetched_bytes} bytes_fetched")
+
+
+def recursive_structural_elements(elements):
+    """
+    The recursive read_structural_elements that decode_doc's explicit-stack
+    walk replaced, kept as the reference it is checked against
+    """
+    from decode_doc import read_paragraph_element
+
+    full_text = []
+    tables_data = []
+    for element in elements:
+        if 'paragraph' in element:
+            for p_elem in element.get('paragraph', {}).get('elements', []):
+                full_text.append(read_paragraph_element(p_elem))
+        elif 'table' in element:
+            current_table = []
+            for row in element.get('table', {}).get('tableRows', []):
+                current_row = []
+                for cell in row.get('tableCells', []):
+                    cell_text, nested_tables = recursive_structural_elements(cell.get('content', []))
+                    current_row.append(''.join(cell_text))
+                    tables_data.extend(nested_tables)
+                current_table.append(current_row)
+            tables_data.append(current_table)
+            full_text.append('[TABLE_START]')
+            full_text.append('[TABLE_END]')
+        elif 'sectionBreak' in element:
+            full_text.append('\n--- Section Break ---\n')
+        elif 'tableOfContents' in element:
+            toc_text, nested_tables = recursive_structural_elements(
+                element.get('tableOfContents', {}).get('content', []))
+            full_text.extend(toc_text)
+            tables_data.extend(nested_tables)
+    return full_text, tables_data
+
+
+def random_structural_elements(rng, depth=3):
+    """
+    A random StructuralElement list: paragraphs (with inline objects),
+    section breaks, tables of contents and ragged tables nested up to depth
+    """
+    def paragraph():
+        return {'paragraph': {'elements': [
+            {'textRun': {'content': rng.choice(['', 'a', 'xy\n', '12', GLYPHS[rng.randrange(4)]])}}
+            if rng.random() < 0.8 else {'inlineObjectElement': {}}
+            for _ in range(rng.randrange(3))
+        ]}}
+
+    elements = []
+    for _ in range(rng.randrange(5)):
+        kind = rng.random()
+        if kind < 0.45:
+            elements.append(paragraph())
+        elif kind < 0.55:
+            elements.append({'sectionBreak': {}})
+        elif kind < 0.65 and depth:
+            elements.append({'tableOfContents': {'content': random_structural_elements(rng, depth - 1)}})
+        elif depth:
+            elements.append({'table': {'tableRows': [
+                {'tableCells': [{'content': random_structural_elements(rng, depth - 1)}
+                                for _ in range(rng.randrange(4))]}
+                for _ in range(rng.randrange(4))
+            ]}})
+    return elements
+
+
+def bench_structural(args):
+    """Check read_structural_elements against the recursive version it replaced"""
+    from decode_doc import read_structural_elements
+
+    rng = random.Random(args.seed)
+    tables = 0
+    for i in range(args.docs):
+        elements = random_structural_elements(rng, args.depth)
+        expected_text, expected_tables = recursive_structural_elements(elements)
+        text, found_tables = read_structural_elements(elements)
+        assert text == [''.join(expected_text)], f"document {i}: text differs"
+        assert found_tables == expected_tables, f"document {i}: tables differ"
+        tables += len(found_tables)
+
+    # far deeper than the recursion limit allows the reference to go
+    element = {'paragraph': {'elements': [{'textRun': {'content': 'deep'}}]}}
+    for _ in range(args.nesting):
+        element = {'table': {'tableRows': [{'tableCells': [{'content': [element]}]}]}}
+    start = time.perf_counter()
+    _, deep_tables = read_structural_elements([element])
+    elapsed = time.perf_counter() - start
+    assert len(deep_tables) == args.nesting and deep_tables[0] == [['deep']], "deep nesting lost tables"
+
+    print(f"{args.docs} random documents ({tables} tables) match the recursive reader")
+    print(f"ok: {args.nesting} nested tables read without recursion in {elapsed:.3f}s")
+
+
+def random_span_table(rng, rows=6, cols=5):
+    """Random rows of (text, colspan, rowspan) cells; some rows are empty"""
+    return [
+        [(f"r{r}c{c}", rng.choice((1, 1, 1, 2, 3)), rng.choice((1, 1, 1, 2, 3))) for c in range(rng.randrange(cols))]
+        for r in range(rng.randrange(1, rows))
+    ]
+
+
+def reference_span_layout(table_rows):
+    """
+    Lay cells out the plain way: a dict of taken (row, column) positions,
+    each cell at the first free column of its row, its span filled with ''.
+    Rows without cells of their own are dropped, and every row is padded to
+    the widest (rowspans included).
+    """
+    taken = {}
+    rows = []
+    for r, cells in enumerate(table_rows):
+        c = 0
+        for text, colspan, rowspan in cells:
+            while (r, c) in taken:
+                c += 1
+            for dr in range(rowspan):
+                for dc in range(colspan):
+                    taken[(r + dr, c + dc)] = text if dr == dc == 0 else ''
+            c += colspan
+        if cells:
+            width = max((col + 1 for row, col in taken if row == r), default=0)
+            rows.append([taken.get((r, col), '') for col in range(width)])
+    width = max((len(row) for row in rows), default=0)
+    return [row + [''] * (width - len(row)) for row in rows]
+
+
+def bench_spans(args):
+    """Check TableBuilder and every HTML path against a plain span layout"""
+    from gdoc_scrape_0 import parse_html_tables
+    from table_model import TableBuilder
+
+    rng = random.Random(args.seed)
+    spans = 0
+    for i in range(args.tables):
+        table_rows = random_span_table(rng, args.rows, args.cols)
+        expected = reference_span_layout(table_rows)
+
+        builder = TableBuilder()
+        for cells in table_rows:
+            builder.start_row()
+            for text, colspan, rowspan in cells:
+                builder.add_cell(text, colspan, rowspan)
+        grid = builder.finish()
+        assert grid == expected, f"table {i}: TableBuilder gave {grid!r}, expected {expected!r}"
+        assert grid.width == max((len(row) for row in expected), default=0), f"table {i}: width {grid.width}"
+
+        html = '<table>' + ''.join(
+            '<tr>' + ''.join(f'<td colspan="{colspan}" rowspan="{rowspan}">{text}</td>'
+                             for text, colspan, rowspan in cells) + '</tr>'
+            for cells in table_rows
+        ) + '</table>'
+        found = {'bs4': parse_html_tables(html)}
+        for backend in available_backends():
+            found[backend] = parse_html(html, backend=backend)
+        for name, tables in found.items():
+            assert tables == ([expected] if expected else []), f"table {i}: {name} gave {tables!r}, expected {expected!r}"
+        spans += sum(colspan > 1 or rowspan > 1 for cells in table_rows for _, colspan, rowspan in cells)
+
+    print(f"{args.tables} random tables ({spans} spanning cells) through TableBuilder, bs4 and "
+          f"{', '.join(available_backends())}")
+    print("ok: every path matches the plain span layout")
+
+
+def brute_force_rows(cells, x0, y0, x1, y1, sep=' '):
+    """
+    Render the region x0 <= x < x1, y0 <= y < y1 of a {(x, y): glyph} dict
+    column by column: each row runs from x0 to its last cell, with ' ' for
+    empty columns, joined by sep
+    """
+    rows = []
+    for y in range(y0, y1):
+        xs = [x for x in range(x0, x1) if (x, y) in cells]
+        rows.append(sep.join(cells.get((x, y), ' ') for x in range(x0, xs[-1] + 1)) if xs else '')
+    return rows
+
+
+def random_cells(rng, size=60, fill=None):
+    """A random {(x, y): glyph} dict, negative coordinates included"""
+    fill = rng.choice((0.01, 0.1, 0.5)) if fill is None else fill
+    lo = -rng.randrange(8)
+    return {
+        (x, y): rng.choice(GLYPHS)
+        for x in range(lo, size) for y in range(lo, size) if rng.random() < fill
+    }
+
+
+def bench_tiles(args):
+    """Check full, windowed and tiled rendering against a brute-force renderer"""
+    rng = random.Random(args.seed)
+    tiles = 0
+    for i in range(args.grids):
+        cells = random_cells(rng, args.size)
+        if not cells:
+            continue
+        grid = MosaicGrid.from_dict(cells)
+        sep = rng.choice((' ', ''))
+
+        ox, oy = grid.bounds.default_origin()
+        max_x = max(x for x, _ in cells)
+        max_y = max(y for _, y in cells)
+        expected = brute_force_rows(cells, ox, oy, max_x + 1, max_y + 1, sep)
+        assert list(grid.iter_rows(sep=sep)) == expected, f"grid {i}: full render differs"
+
+        for _ in range(5):
+            x0, x1 = sorted(rng.randrange(-10, args.size + 10) for _ in range(2))
+            y0, y1 = sorted(rng.randrange(-10, args.size + 10) for _ in range(2))
+            window = list(grid.iter_window(x0, y0, x1, y1, sep=sep))
+            assert window == brute_force_rows(cells, x0, y0, x1, y1, sep), f"grid {i}: window {(x0, y0, x1, y1)} differs"
+
+        width, height = rng.randrange(1, 20), rng.randrange(1, 20)
+        origins = sorted({(y // height * height, x // width * width) for x, y in cells})
+        expected_tiles = [
+            (tx, ty, brute_force_rows(cells, tx, ty, tx + width, ty + height, sep))
+            for ty, tx in origins
+        ]
+        assert list(grid.iter_tiles(width, height, sep=sep)) == expected_tiles, f"grid {i}: {width}x{height} tiles differ"
+        tiles += len(expected_tiles)
+
+    for width, height in ((0, 1), (1, 0), (-2, 3)):
+        try:
+            grid.iter_tiles(width, height)
+        except ValueError:
+            continue
+        raise AssertionError(f"iter_tiles accepted a {width}x{height} tile")
+
+    print(f"{args.grids} random grids checked: full render, 5 windows each, {tiles} tiles in all")
+    print("ok: MosaicGrid matches the brute-force renderer; tile sizes below 1 are rejected")
+
+
+def bench_delta(args):
+    """Check incremental re-decode against a full render after random edit rounds"""
+    from mosaic_delta import DeltaStore
+
+    rng = random.Random(args.seed)
+    cells = random_cells(rng, args.size, fill=0.2)
+    changes = 0
+    with tempfile.TemporaryDirectory() as state_dir:
+        store = DeltaStore(state_dir)
+        previous = {}
+        for round_ in range(args.rounds):
+            # insert, remove and re-glyph cells; now and then reach past the origin
+            for _ in range(rng.randrange(1, 30)):
+                lo = -rng.randrange(5) if rng.random() < 0.1 else 0
+                key = (rng.randrange(lo, args.size), rng.randrange(lo, args.size))
+                if key in cells and rng.random() < 0.5:
+                    del cells[key]
+                else:
+                    cells[key] = rng.choice(GLYPHS)
+            table = [list(HEADERS)] + [[str(x), glyph, str(y)] for (x, y), glyph in cells.items()]
+
+            delta, = store.update('benchDelta', [table])
+            # a fresh store reads the state back from disk, as the next run would
+            state, = DeltaStore(state_dir).load('benchDelta')
+            expected = list(MosaicGrid.from_dict(cells).iter_rows()) if cells else []
+            rows = list(state.iter_rows())
+            assert rows == expected, f"round {round_}: stored lines differ from a full render"
+
+            # a consumer patching the previous lines with the delta gets the same
+            patched = dict(previous)
+            patched.update(delta.lines)
+            assert [patched.get(y, '') for y in range(state.origin[1], state.max_y + 1)] == expected, (
+                f"round {round_}: previous lines + delta differ from a full render")
+            previous = {y: line for y, line in patched.items() if line}
+            changes += len(delta.inserted) + len(delta.removed) + len(delta.changed)
+
+    print(f"{args.rounds} random edit rounds, {changes} cell changes reported")
+    print("ok: stored lines and patched lines match a full render after every round")
+
+
+def bench_service(args):
+    """Check the mosaic service: one fetch per burst, LRU bounds, TTL and ID validation"""
+    import threading
+    import urllib.error
+    import urllib.request
+
+    from mosaic_service import DocumentService, LRUCache, make_server
+
+    rng = random.Random(args.seed)
+    docs = {f"doc{i}": random_cells(rng, 40, fill=0.2) for i in range(args.docs)}
+    tables = {
+        doc_id: [[list(HEADERS)] + [[str(x), glyph, str(y)] for (x, y), glyph in cells.items()]]
+        for doc_id, cells in docs.items()
+    }
+    fetched = []
+
+    def slow_fetch(document_id):
+        fetched.append(document_id)
+        time.sleep(args.delay)
+        return tables[document_id]
+
+    def expected_mosaic(doc_id):
+        return '\n'.join(MosaicGrid.from_dict(docs[doc_id]).iter_rows()) + '\n'
+
+    def kept_bytes(cache):
+        stats = cache.stats()
+        # what the LRU counts must be what its documents hold now, views included
+        assert stats['bytes'] == sum(document.size for document, _, _ in cache._entries.values()), (
+            "LRU byte count differs from the kept documents' sizes")
+        return stats
+
+    service = DocumentService(LRUCache(max_bytes=args.max_bytes), {'published': slow_fetch})
+    server = make_server(port=0, service=service)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def get(path):
+        try:
+            with urllib.request.urlopen(base + path) as response:
+                return response.status, response.read().decode('utf-8')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode('utf-8')
+
+    # the handler logs a line per request
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            # a burst of requests for one cold document: one fetch, same answer
+            barrier = threading.Barrier(args.requests)
+            results = [None] * args.requests
+
+            def request(i):
+                barrier.wait()
+                results[i] = get('/docs/doc0/mosaic')
+
+            threads = [threading.Thread(target=request, args=(i,)) for i in range(args.requests)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert service.fetches == 1 and fetched == ['doc0'], (
+                f"{args.requests} concurrent requests made {service.fetches} fetches")
+            assert all(result == (200, expected_mosaic('doc0')) for result in results), "burst answers differ"
+            burst = service.stats()
+
+            # every document through every view; building cells and the
+            # mosaic grows a document, and the LRU must stay in its bounds
+            for doc_id in docs:
+                for view in ('tables', 'cells', 'mosaic'):
+                    status, body = get(f"/docs/{doc_id}/{view}")
+                    assert status == 200, f"{doc_id}/{view}: {status}"
+                    stats = kept_bytes(service.cache)
+                    assert stats['bytes'] <= args.max_bytes, (
+                        f"{doc_id}/{view}: LRU holds {stats['bytes']} bytes, bound {args.max_bytes}")
+                assert body == expected_mosaic(doc_id), f"{doc_id}: mosaic differs"
+            assert service.cache.evictions, "--max-bytes too large to exercise eviction"
+
+            # malformed IDs are refused before any fetch
+            fetches = service.fetches
+            for bad in ('bad%20id', 'doc..', 'doc%2F..%2Fx', 'doc;1'):
+                status, _ = get(f"/docs/{bad}/tables")
+                assert status == 400, f"{bad}: {status}, expected 400"
+            assert service.fetches == fetches, "a malformed ID reached the fetcher"
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    # TTL on a fake clock: served until it runs out, then fetched again
+    now = [0.0]
+    service = DocumentService(LRUCache(ttl=args.ttl, clock=lambda: now[0]), {'published': slow_fetch})
+    service.get('doc0')
+    now[0] += args.ttl
+    service.get('doc0')
+    assert service.fetches == 1, "an entry expired before its TTL"
+    now[0] += 0.001
+    service.get('doc0')
+    assert service.fetches == 2, "an expired entry was still served"
+
+    print(f"{args.requests} concurrent requests: {burst['fetches']} fetch, {burst['coalesced']} coalesced")
+    print(f"{args.docs} docs x 3 views within {args.max_bytes} bytes: "
+          f"{stats['evictions']} evictions, {stats['bytes']} bytes kept")
+    print("ok: one fetch per burst, LRU within its byte bound, TTL honoured, bad IDs refused")
+
+
+def bench_parsers(args):
+    """Compare the BeautifulSoup path with the single-pass backends"""
+    # imported here so the other benchmarks don't pay for bs4 / requests
+    from gdoc_scrape_0 import parse_html_tables
+
+    html = synthetic_published_doc(args.rows, args.tables, depth=args.depth)
+    print(f"Synthetic doc: {len(html) / 1e6:.1f} MB, {args.tables} table(s) x {args.rows} rows, "
+          f"{args.depth} layout table(s) around each")
+
+    baseline_time, expected = best_time(lambda: parse_html_tables(html), args.repeat)
+    print(f"{'bs4':<12} {baseline_time:8.3f}s  1.00x")
+
+    for backend in available_backends():
+        elapsed, tables = best_time(lambda: parse_html(html, backend=backend), args.repeat)
+        if tables == expected:
+            status = 'same output'
+        elif (len(tables) == len(expected)
+              and [is_mosaic_table(t) for t in tables] == [is_mosaic_table(t) for t in expected]
+              and [t for t in tables if is_mosaic_table(t)] == [t for t in expected if is_mosaic_table(t)]):
+            # bs4 also lists a nested table's rows among the layout table's
+            status = 'same tables in the same order (layout tables hold only their own rows)'
+        else:
+            status = 'OUTPUT DIFFERS'
+        print(f"{backend:<12} {elapsed:8.3f}s  {baseline_time / elapsed:.2f}x  {status}")
+
+
+def synthetic_mosaic(width=1000, height=1000, fill=0.5, seed=0):
+    """Return {(x, y): glyph} covering roughly fill of a width x height box"""
+    rng = random.Random(seed)
+    return {
+        (x, y): rng.choice(GLYPHS)
+        for y in range(height) for x in range(width)
+        if rng.random() < fill
+    }
+
+
+def bench_render(args):
+    """Compare per-cell / per-row print with the buffered renderer"""
+    cells = synthetic_mosaic(args.width, args.height)
+    print(f"Synthetic mosaic: {args.width} x {args.height}, {len(cells)} cells")
+
+    # Build the row strings once so only the output path is timed
+    rows = [
+        ''.join([cells.get((x, y), ' ') for x in range(args.width)])
+        for y in range(args.height)
+    ]
+
+    def print_per_cell():
+        # what draw_matrix used to do
+        for row in rows:
+            for shape in row:
+                print(shape, end='')
+            print()
+
+    def print_per_row():
+        for row in rows:
+            print(row)
+
+    def buffered():
+        render_rows(rows)
+
+    # Line buffered, like stdout on a terminal
+    with open(os.devnull, 'w', encoding='utf-8', buffering=1) as devnull:
+        results = []
+        for name, func in (('print per cell', print_per_cell),
+                           ('print per row', print_per_row),
+                           ('render_rows', buffered)):
+            with contextlib.redirect_stdout(devnull):
+                elapsed, _ = best_time(func, args.repeat)
+            results.append((name, elapsed))
+
+    baseline = results[0][1]
+    for name, elapsed in results:
+        print(f"{name:<16} {elapsed:8.3f}s  {baseline / elapsed:.2f}x")
+
+
+# Stacks a warm-cache run should never import
+HEAVY_MODULES = ('requests', 'bs4', 'lxml', 'googleapiclient', 'google.auth', 'numpy')
+
+STARTUP_DOC_ID = 'benchStartupDoc'
+
+
+def parse_importtime(stderr):
+    """Return [(self us, cumulative us, module)] from -X importtime output"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        imports.append((int(self_us), int(cumulative_us), module.strip()))
+    return imports
+
+
+def time_startup(argv, env, repeat):
+    """Run argv under -X importtime; return (best wall seconds, imports of that run)"""
+    best = None
+    imports = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime'] + argv,
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+            imports = parse_importtime(result.stderr)
+    return best, imports
+
+
+def bench_startup(args):
+    """Time CLI startup on a warm table cache and list what was imported"""
+    from table_cache import API, PUBLISHED, TableCache, cache_key
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    cli = os.path.join(here, 'gdoc_cli.py')
+    url = f"https://docs.google.com/document/d/e/{STARTUP_DOC_ID}/pub"
+    rows = [['x-coordinate', 'Character', 'y-coordinate']]
+    rows += [[str(x), GLYPHS[x % len(GLYPHS)], str(x % 8)] for x in range(args.rows)]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # warm the cache the way a previous run would have, and opt in to
+        # serving it without a request (GDOC_CACHE_MAX_AGE)
+        cache = TableCache(cache_dir)
+        cache.store(cache_key(STARTUP_DOC_ID, PUBLISHED), [rows])
+        cache.store(cache_key(STARTUP_DOC_ID, API), [rows])
+        env = dict(os.environ, GDOC_CACHE_DIR=cache_dir, GDOC_CACHE_MAX_AGE='1e9')
+
+        runs = (
+            ('interpreter', ['-c', 'pass']),
+            ('scrape (warm)', [cli, 'scrape', url]),
+            ('decode (warm)', [cli, 'decode', STARTUP_DOC_ID]),
+        )
+        for name, argv in runs:
+            elapsed, imports = time_startup(argv, env, args.repeat)
+            total_ms = sum(self_us for self_us, _, _ in imports) / 1000
+            heavy = sorted({
+                heavy_name for _, _, module in imports for heavy_name in HEAVY_MODULES
+                if module == heavy_name or module.startswith(heavy_name + '.')
+            })
+            print(f"{name:<16} {elapsed * 1000:8.1f} ms wall  {total_ms:8.1f} ms imports  "
+                  f"{len(imports):4d} modules  heavy: {', '.join(heavy) or 'none'}")
+            for self_us, cumulative_us, module in sorted(imports, reverse=True)[:args.top]:
+                print(f"    {self_us / 1000:8.2f} ms self  {cumulative_us / 1000:8.2f} ms cumulative  {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    parsers = subparsers.add_parser('parsers', help='bs4 vs event-stream HTML table extraction')
+    parsers.add_argument('--rows', type=int, default=50000)
+    parsers.add_argument('--tables', type=int, default=1)
+    parsers.add_argument('--depth', type=int, default=0, help='layout tables wrapped around each mosaic table')
+    parsers.add_argument('--repeat', type=int, default=3)
+    parsers.set_defaults(func=bench_parsers)
+
+    render = subparsers.add_parser('render', help='per-cell / per-row print vs buffered rendering')
+    render.add_argument('--width', type=int, default=1000)
+    render.add_argument('--height', type=int, default=1000)
+    render.add_argument('--repeat', type=int, default=3)
+    render.set_defaults(func=bench_render)
+
+    startup = subparsers.add_parser('startup', help='CLI startup time and imports on a warm cache')
+    startup.add_argument('--rows', type=int, default=1000)
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.add_argument('--top', type=int, default=5, help='slowest imports to list per run')
+    startup.set_defaults(func=bench_startup)
+
+    throttle = subparsers.add_parser('throttle', help='fetch scheduler against a quota-enforcing stub server')
+    throttle.add_argument('--docs', type=int, default=200)
+    throttle.add_argument('--rows', type=int, default=20, help='rows per synthetic doc')
+    throttle.add_argument('--workers', type=int, default=16)
+    throttle.add_argument('--server-rate', type=float, default=50, help='requests per second the server accepts')
+    throttle.add_argument('--error-rate', type=float, default=0.05, help='fraction of accepted requests failing with 503')
+    throttle.add_argument('--retry-after', default='0.2', help='Retry-After sent with each 429')
+    throttle.add_argument('--rate', type=float, default=60,
+                          help='client-side requests per second (above --server-rate, so some 429s are met)')
+    throttle.add_argument('--attempts', type=int, default=6)
+    throttle.set_defaults(func=bench_throttle)
+
+    batch = subparsers.add_parser('batch', help="check fetch_documents' batch path against a fake transport")
+    batch.add_argument('--docs', type=int, default=12)
+    batch.add_argument('--batch-size', type=int, default=5)
+    batch.add_argument('--retry-after', type=float, default=0.5, help='Retry-After sent with each 429')
+    batch.set_defaults(func=bench_batch)
+
+    structural = subparsers.add_parser('structural', help='check the Docs API element walk against the recursive one')
+    structural.add_argument('--docs', type=int, default=2000)
+    structural.add_argument('--depth', type=int, default=3, help='nesting depth of the random documents')
+    structural.add_argument('--nesting', type=int, default=5000, help='depth of the deeply nested document')
+    structural.add_argument('--seed', type=int, default=0)
+    structural.set_defaults(func=bench_structural)
+
+    spans = subparsers.add_parser('spans', help='check rowspan / colspan placement against a plain layout')
+    spans.add_argument('--tables', type=int, default=2000)
+    spans.add_argument('--rows', type=int, default=6)
+    spans.add_argument('--cols', type=int, default=5)
+    spans.add_argument('--seed', type=int, default=0)
+    spans.set_defaults(func=bench_spans)
+
+    tiles = subparsers.add_parser('tiles', help='check full / windowed / tiled rendering against brute force')
+    tiles.add_argument('--grids', type=int, default=300)
+    tiles.add_argument('--size', type=int, default=60, help='coordinates fall below size on both axes')
+    tiles.add_argument('--seed', type=int, default=0)
+    tiles.set_defaults(func=bench_tiles)
+
+    delta = subparsers.add_parser('delta', help='check incremental re-decode against full renders')
+    delta.add_argument('--rounds', type=int, default=40)
+    delta.add_argument('--size', type=int, default=60, help='coordinates fall below size on both axes')
+    delta.add_argument('--seed', type=int, default=0)
+    delta.set_defaults(func=bench_delta)
+
+    service = subparsers.add_parser('service', help='check the mosaic service against a slow stub fetcher')
+    service.add_argument('--requests', type=int, default=10, help='concurrent requests for one document')
+    service.add_argument('--docs', type=int, default=8)
+    service.add_argument('--max-bytes', type=int, default=200_000, help='LRU byte bound')
+    service.add_argument('--ttl', type=float, default=300)
+    service.add_argument('--delay', type=float, default=0.2, help='seconds each stub fetch takes')
+    service.add_argument('--seed', type=int, default=0)
+    service.set_defaults(func=bench_service)
+
+    pipeline = subparsers.add_parser('pipeline', help='per-stage time and peak memory of both scrape paths')
+    pipeline.add_argument('--rows', type=int, default=10000)
+    pipeline.add_argument('--tables', type=int, default=1)
+    pipeline.add_argument('--depth', type=int, default=0, help='layout tables wrapped around each mosaic table')
+    pipeline.add_argument('--span-every', type=int, default=0, help='add a rowspan=2 note cell every N rows')
+    pipeline.add_argument('--width', type=int, default=None, help='x coordinates fall in [0, width) (default: rows)')
+    pipeline.add_argument('--height', type=int, default=None, help='y coordinates fall in [0, height) (default: rows)')
+    pipeline.add_argument('--repeat', type=int, default=3)
+    pipeline.add_argument('--output', metavar='FILE', help='append results as JSON lines')
+    pipeline.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,19 @@
+import datetime
+import io
+import json
 import os
 import re
+import sys
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+# The google-auth / googleapiclient stack is imported on first use, so a run
+# served from the table cache (or one without credentials) never loads it
+
+from diagnostics import get_diagnostics_log
+from fetch_scheduler import classify_http_error, get_scheduler
+from metrics import get_metrics
+from mosaic_grid import MosaicGrid, parse_coordinate_columns
+from mosaic_render import render_rows, render_tiles
+from table_cache import API, cache_key, get_table_cache
 
 # --- Configuration ---
 SCOPES = [
@@ -28,6 +38,14 @@ SERVICE_ACCOUNT_KEY_FILE = './credentials/service_account_key.json'
 DOCUMENT_ID = '1ciO1rXzD5bQIlmEkY0h2OLPwHh25nAsl969rx-XvtP8' # dataNotation assessment data
 
 # --- Authentication Function ---
+def _is_http_error(error):
+    """
+    True for googleapiclient's HttpError. Checked without importing the
+    client library: if it was never imported, nothing can have raised it.
+    """
+    errors = sys.modules.get('googleapiclient.errors')
+    return errors is not None and isinstance(error, errors.HttpError)
+
 def get_service_account_creds():
     """Authenticates using a service account."""
     if not os.path.exists(SERVICE_ACCOUNT_KEY_FILE):
@@ -35,10 +53,63 @@ def get_service_account_creds():
             f"Service account key file not found at: {SERVICE_ACCOUNT_KEY_FILE}\n"
             "Please create a service account and download its JSON key file."
         )
+    from google.oauth2 import service_account
+
     creds = service_account.Credentials.from_service_account_file(
         SERVICE_ACCOUNT_KEY_FILE, scopes=SCOPES)
     return creds
 
+# --- Long-lived API Client ---
+
+# Refresh the access token when it has less than this many seconds left
+TOKEN_REFRESH_MARGIN = 300
+
+class DocsClient:
+    """
+    Holds one set of credentials and one Docs service object for the life of
+    the process. The service is built from the client library's bundled
+    (static) discovery document, once. Not thread-safe: give each thread its
+    own client.
+    """
+
+    def __init__(self, creds=None, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.creds = creds or get_service_account_creds()
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self._service = None
+
+    def _needs_refresh(self):
+        if not self.creds.token or self.creds.expiry is None:
+            return True
+        # google-auth keeps expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return self.creds.expiry - now <= self.refresh_margin
+
+    def refresh_if_needed(self):
+        """Refresh the access token ahead of expiry rather than on a 401"""
+        if self._needs_refresh():
+            from google.auth.transport.requests import Request
+            self.creds.refresh(Request())
+
+    def service(self):
+        """Return the shared Docs v1 service with a valid token"""
+        self.refresh_if_needed()
+        if self._service is None:
+            from googleapiclient.discovery import build
+            self._service = build(
+                'docs', 'v1', credentials=self.creds,
+                static_discovery=True, cache_discovery=False,
+            )
+        return self._service
+
+_docs_client = None
+
+def get_docs_client():
+    """Return the process-wide DocsClient, loading credentials on first use."""
+    global _docs_client
+    if _docs_client is None:
+        _docs_client = DocsClient()
+    return _docs_client
+
 # --- Helper Functions to Parse Document Content ---
 
 def read_paragraph_element(element):
@@ -49,47 +120,91 @@ def read_paragraph_element(element):
         return ""
     return text_run.get('content', '')
 
-def read_structural_elements(elements):
+class _TableCursor:
+    """Walk position inside one table: the grid being filled and the open cell."""
+
+    __slots__ = ('rows', 'grid', 'r', 'c', 'start')
+
+    def __init__(self, rows):
+        self.rows = rows
+        # Preallocate the whole table up front; cells are filled in place
+        self.grid = [[None] * len(row.get('tableCells', [])) for row in rows]
+        self.r = 0
+        self.c = -1
+        self.start = None
+
+    def advance(self):
+        """Move to the next cell; returns False once the table is finished."""
+        self.c += 1
+        while self.r < len(self.grid) and self.c >= len(self.grid[self.r]):
+            self.r += 1
+            self.c = 0
+        return self.r < len(self.grid)
+
+    def cell_content(self):
+        return self.rows[self.r]['tableCells'][self.c].get('content', [])
+
+def _pop_text(buf, start):
+    """Remove and return everything written to buf since offset start."""
+    buf.seek(start)
+    text = buf.read()
+    buf.seek(start)
+    buf.truncate()
+    return text
+
+def iter_structural_tables(elements, buf=None):
     """
-    Recursively reads text from a list of Structural Elements.
-    Handles paragraphs, tables, and nested content.
-    Returns collected text and extracts table data.
+    Walks a list of Structural Elements with an explicit stack (no recursion)
+    and yields each table as soon as it closes, nested tables before the
+    table that contains them. Document text, with table placeholders, is
+    written to buf (an io.StringIO) when one is given.
     """
-    full_text = []
-    tables_data = []
-
-    for element in elements:
-        if 'paragraph' in element:
+    if buf is None:
+        buf = io.StringIO()
+    stack = [iter(elements)]
+
+    while stack:
+        frame = stack[-1]
+
+        if isinstance(frame, _TableCursor):
+            if frame.start is not None:
+                # The cell's content has been walked; its text is the tail of buf
+                frame.grid[frame.r][frame.c] = _pop_text(buf, frame.start)
+            if frame.advance():
+                frame.start = buf.tell()
+                stack.append(iter(frame.cell_content()))
+                continue
+            stack.pop()
+            buf.write("[TABLE_START]") # Placeholder for table in text flow
+            buf.write("[TABLE_END]")
+            yield frame.grid
+            continue
+
+        element = next(frame, None)
+        if element is None:
+            stack.pop()
+        elif 'paragraph' in element:
             # It's a paragraph
-            paragraph_elements = element.get('paragraph', {}).get('elements', [])
-            for p_elem in paragraph_elements:
-                full_text.append(read_paragraph_element(p_elem))
+            for p_elem in element.get('paragraph', {}).get('elements', []):
+                buf.write(read_paragraph_element(p_elem))
         elif 'table' in element:
-            # It's a table
-            table = element.get('table', {})
-            current_table = []
-            for row in table.get('tableRows', []):
-                current_row = []
-                for cell in row.get('tableCells', []):
-                    # Table cells can contain nested structural elements
-                    cell_content_text, nested_tables = read_structural_elements(cell.get('content', []))
-                    current_row.append("".join(cell_content_text))
-                    tables_data.extend(nested_tables) # Collect any nested tables
-
-                current_table.append(current_row)
-            tables_data.append(current_table) # Add the current table's data
-            full_text.append("[TABLE_START]") # Placeholder for table in text flow
-            # Optionally, you can insert a formatted representation of the table here if you want it in full_text
-            full_text.append("[TABLE_END]")
+            # It's a table - its cells can contain nested structural elements
+            stack.append(_TableCursor(element.get('table', {}).get('tableRows', [])))
         elif 'sectionBreak' in element:
-            full_text.append("\n--- Section Break ---\n")
+            buf.write("\n--- Section Break ---\n")
         elif 'tableOfContents' in element:
             # TOC also contains structural elements
-            toc_content_text, nested_tables = read_structural_elements(element.get('tableOfContents', {}).get('content', []))
-            full_text.extend(toc_content_text)
-            tables_data.extend(nested_tables)
+            stack.append(iter(element.get('tableOfContents', {}).get('content', [])))
 
-    return full_text, tables_data
+def read_structural_elements(elements):
+    """
+    Reads text from a list of Structural Elements.
+    Handles paragraphs, tables, and nested content.
+    Returns collected text (as a one-item list) and extracts table data.
+    """
+    buf = io.StringIO()
+    tables_data = list(iter_structural_tables(elements, buf))
+    return [buf.getvalue()], tables_data
 
 def extract_multi_digit_numbers_as_integers(text):
     # print("Extracting multi-digit integers from text...")
@@ -110,170 +225,287 @@ def extract_multi_digit_numbers_as_integers(text):
     # print("numbers_as_integers:", numbers_as_integers)
     return numbers_as_integers
 
+# --- Fetch Functions ---
+
+# Nested tables deeper than this come back with their full cell content
+FIELD_MASK_DEPTH = 3
+
+# A table of contents only ever holds paragraphs
+TOC_FIELDS = "content(paragraph(elements(textRun(content))))"
+
+# Requests per batch HTTP call
+BATCH_SIZE = 50
+
+def structural_elements_mask(depth=FIELD_MASK_DEPTH):
+    """
+    Builds a field mask selecting only the parts of a StructuralElement list
+    that read_structural_elements looks at.
+    """
+    if depth <= 0:
+        return "content"
+    nested = structural_elements_mask(depth - 1)
+    return (
+        "content("
+        "paragraph(elements(textRun(content))),"
+        f"table(tableRows(tableCells({nested}))),"
+        "sectionBreak,"
+        f"tableOfContents({TOC_FIELDS})"
+        ")"
+    )
+
+# title / revisionId are shown and used as the cache validator
+DOCUMENT_FIELDS = f"title,revisionId,body({structural_elements_mask()})"
+
+# Rate-limit key for every Docs API call (one per-project quota)
+DOCS_API_QUOTA = 'docs.googleapis.com'
+
+def document_size(document):
+    """A fetched document's size as compact JSON, close to its response body"""
+    return len(json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+def fetch_document(service, document_id, fields=DOCUMENT_FIELDS, scheduler=None):
+    """
+    Gets one document, restricted to the given field mask. 429 / 5xx
+    responses are retried with backoff (see fetch_scheduler.py) by scheduler,
+    the process-wide FetchScheduler by default.
+    """
+    request = service.documents().get(documentId=document_id, fields=fields)
+    document = (scheduler or get_scheduler()).call(DOCS_API_QUOTA, request.execute, classify=classify_http_error)
+    metrics = get_metrics()
+    if metrics.enabled:
+        metrics.add('bytes_fetched', document_size(document))
+    return document
+
+def fetch_documents(service, document_ids, fields=DOCUMENT_FIELDS, batch_size=BATCH_SIZE, scheduler=None):
+    """
+    Gets many documents through the API client's batch HTTP facility.
+    Returns {document_id: document}; a document whose request failed maps to
+    the HttpError raised for it. Requests throttled (429) or failed with a
+    5xx inside a batch go round again, after a backoff, in a smaller batch.
+    """
+    scheduler = scheduler or get_scheduler()
+    metrics = get_metrics()
+    results = {}
+
+    def callback(request_id, response, exception):
+        results[request_id] = exception if exception is not None else response
+        if exception is None and metrics.enabled:
+            metrics.add('bytes_fetched', document_size(response))
+
+    pending = list(dict.fromkeys(document_ids))
+    attempt = 0
+    while pending:
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=callback)
+            for document_id in chunk:
+                batch.add(
+                    service.documents().get(documentId=document_id, fields=fields),
+                    request_id=document_id,
+                )
+            # each request in the batch counts against the quota
+            scheduler.call(DOCS_API_QUOTA, batch.execute, classify=classify_http_error, cost=len(chunk))
+
+        retry_ids = []
+        retry_after = None
+        for document_id in pending:
+            retry, wait = classify_http_error(results[document_id])
+            if retry:
+                retry_ids.append(document_id)
+                if wait is not None:
+                    retry_after = wait if retry_after is None else max(retry_after, wait)
+        if not retry_ids or attempt + 1 >= scheduler.policy.attempts:
+            break
+        scheduler.backoff(DOCS_API_QUOTA, attempt, retry_after)
+        pending = retry_ids
+        attempt += 1
+
+    return results
+
+def get_documents_tables(document_ids, service=None):
+    """
+    Returns {document_id: tables} for many documents, taking fresh entries
+    from the table cache and fetching the rest in batches. Documents that
+    could not be fetched map to the HttpError raised for them.
+    """
+    cache = get_table_cache()
+    tables_by_id = {}
+    to_fetch = []
+    for document_id in document_ids:
+        tables = cache.load_fresh(cache_key(document_id, API))
+        if tables is None:
+            to_fetch.append(document_id)
+        else:
+            tables_by_id[document_id] = tables
+
+    if to_fetch:
+        if service is None:
+            service = get_docs_client().service()
+        for document_id, document in fetch_documents(service, to_fetch).items():
+            if isinstance(document, Exception):
+                tables_by_id[document_id] = document
+                continue
+            body_content = document.get('body', {}).get('content', [])
+            _, tables = read_structural_elements(body_content)
+            cache.store(cache_key(document_id, API), tables, etag=document.get('revisionId'))
+            tables_by_id[document_id] = tables
+
+    return tables_by_id
+
 # --- Main Function to Get Document and Extract Table Content ---
-def get_document_table_contents(document_id):
-    creds = get_service_account_creds()
+def decode_table(table_data):
+    """
+    Decodes one table into {(x, y): shape}. Returns (mosaic, bad_rows) where
+    bad_rows lists the (index, reason) of rows that could not be parsed.
+    """
+    # parse the x / y columns of the whole table in one pass
+    xs, ys, row_index, bad_rows = parse_coordinate_columns(table_data)
+
+    mosaic_data = {}
+    for x_coord, y_coord, row_num in zip(xs, ys, row_index):
+        mosaic_data[(x_coord, y_coord)] = table_data[row_num][1].strip()
+    return mosaic_data, bad_rows
+
+def decode_tables(tables, parallel=False, max_workers=None):
+    """
+    Decodes every table separately and returns the results in document
+    order. With parallel=True the tables are spread over a process pool.
+    """
+    if parallel and len(tables) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(decode_table, tables))
+    return [decode_table(table_data) for table_data in tables]
+
+def get_document_table_contents(document_id, parallel=False):
+    """
+    Fetches a document and decodes each of its tables.
+    Returns one {(x, y): shape} dict per table, in document order, or None
+    if the document could not be read.
+    """
+    metrics = get_metrics()
+    
+    # a fresh cache entry skips the client, the API call and parsing
+    cache = get_table_cache()
+    with metrics.stage('cache'):
+        all_tables_data = cache.load_fresh(cache_key(document_id, API))
+    client = None
 
     try:
-        service = build('docs', 'v1', credentials=creds)
-        
-        print(f"Fetching document with ID: {document_id}...")
-        # Get the document content
-        document = service.documents().get(documentId=document_id).execute()
-        
-        print(f"Document title: {document.get('title')}")
+        if all_tables_data is not None:
+            print(f"Using cached tables for document ID: {document_id}")
+            metrics.add('cache_hits')
+        else:
+            # a missing key file surfaces here as FileNotFoundError
+            client = get_docs_client()
+            service = client.service()
+            
+            print(f"Fetching document with ID: {document_id}...")
+            # Get the document content
+            with metrics.stage('fetch'):
+                document = fetch_document(service, document_id)
+            
+            print(f"Document title: {document.get('title')}")
 
-        body_content = document.get('body', {}).get('content', [])
-        
-        # Extract all text and tables from the document body
-        full_document_text_parts, all_tables_data = read_structural_elements(body_content)
+            body_content = document.get('body', {}).get('content', [])
+            
+            # Extract all text and tables from the document body
+            with metrics.stage('parse'):
+                full_document_text_parts, all_tables_data = read_structural_elements(body_content)
+
+            print("\n--- Extracted Document Text (with table placeholders) ---")
+            print("".join(full_document_text_parts))
 
-        print("\n--- Extracted Document Text (with table placeholders) ---")
-        print("".join(full_document_text_parts))
+            cache.store(cache_key(document_id, API), all_tables_data, etag=document.get('revisionId'))
 
         print("\n--- Extracted Table Contents ---")
         if not all_tables_data:
             print("No tables found in the document.")
-        else:
-            for i, table_data in enumerate(all_tables_data):
-                print(f"\nTable {i+1}:")
-                
-                mosaic_data = {
-                    "coords": tuple,
-                    "shape": str
-                }
-                
-                for row in table_data:
-                    xy_coord = extract_multi_digit_numbers_as_integers(row)
-                    # print("row:", row)
-                    # row_shape = row[1].strip()
-                    # print(x_coord, row[0].strip()) 
-                    
-                    mosaic_data[tuple(xy_coord)] = row[1].strip()
-                    
-                    # print("row shape:" + row[1])   
-                # print(f"mosaic_data: {mosaic_data}")  
-
-        # strip entries where the ley is of type 'str'
-
-        # --- Example 1: Strip entries where the key is an integer (int) ---
-        new_dict_no_str_keys = {}
-        key_type_to_strip = str
-
-        file_name="./gdoc_log.txt"
-
-        for key, value in mosaic_data.items():
-            if not isinstance(key, key_type_to_strip):
-                if len(key) > 0:
-                  new_dict_no_str_keys[key] = value          
-                with open(file_name, 'a') as f:
-                    f.write(str(key))
-                    # f.write(str(type(key)))
-        
-        # file_name="./gdoc_log.txt"
-        # for key in new_dict_no_str_keys:
-          # print("type(key):", type(key))
-          # print(f"Key: {key} :: shape: {clean_data[key]}")
-          # x_coord, y_coord = key
 
+        metrics.count_tables(all_tables_data)
 
-        # return all_tables_data
-        
-        # print("new_dict_no_str_keys:", new_dict_no_str_keys)
-        
+        # every table is decoded on its own - optionally on a process pool
+        with metrics.stage('decode'):
+            results = decode_tables(all_tables_data, parallel=parallel)
+
+        # buffered & off by default - see diagnostics.py
+        log = get_diagnostics_log()
+
+        mosaics = []
+        for i, (mosaic_data, bad_rows) in enumerate(results):
+            print(f"\nTable {i+1}:")
             
-        # print(f"Key: {key} :: {type(key)} :: shape: {clean_data[key]}")
-        # if len(key) == 0:
-        #  print("Key is nil, skipping...")  
-        
+            # first row is the header - anything else is worth reporting
+            for row_num, reason in bad_rows:
+                if row_num > 0:
+                    print(f"Skipping row {row_num}: {reason}")
+            
+            if log.enabled:
+                for key in mosaic_data:
+                    log.write(str(key))
+            
+            metrics.add('cells_decoded', len(mosaic_data))
+            mosaics.append(mosaic_data)
+        log.flush()
         
-        return new_dict_no_str_keys
+        return mosaics
 
 
-    except HttpError as error:
+    except FileNotFoundError as fnfe:
+        print(f"Error: {fnfe}")
+    except Exception as error:
+        if not _is_http_error(error):
+            print(f"An unexpected error occurred: {error}")
+            return None
         print(f"An HTTP error occurred: {error}")
         if error.resp.status == 403:
             print("Permission denied. Ensure the service account has 'Viewer' access to the Google Doc.")
-            print(f"Service account email: {creds.service_account_email}")
+            if client is not None:
+                print(f"Service account email: {client.creds.service_account_email}")
             print("You might need to share the Google Doc explicitly with this email address.")
         elif error.resp.status == 404:
             print("Document not found. Please double-check the Document ID and its accessibility.")
-    except FileNotFoundError as fnfe:
-        print(f"Error: {fnfe}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
     return None
 
-def draw_matrix(clean_data):
+def draw_matrix(clean_data, window=None, tile=None, export_path=None):
+  """
+  Draws the decoded mosaic. window=(x0, y0, x1, y1) draws only that region
+  (x0 <= x < x1, y0 <= y < y1); tile=(width, height) draws fixed-size tiles.
+  With export_path the mosaic is also written as a binary mosaic file.
+  """
   status = "success"
   print("drawing matrix\n")
   
 
-  # print("--- Iterating through keys ---")
-  
-  # file_name="./gdoc_log.txt"
-  # open(file_name, mode='a', buffering=-1, encoding=None, errors=None, newline=None, closefd=True, opener=None)
-
-  for key in clean_data:
-    x = 1
-    # print("type(key):", type(key))
-    
-    # print(f"Key: {key} :: {type(key)} :: shape: {clean_data[key]}")
-    # print(f"Key: {key} :: shape: {clean_data[key]}")
-    
-    # if len(key) == 0:
-    #  print("Key is nil, skipping...")  
- 
-    # x_coord, y_coord = key
-    # #   print(f"Coordinates: {x_coord}, {y_coord} - Shape: {shape}")
-    # print(f"Coordinates: {x_coord}, {y_coord}")
-
+  if not clean_data:
+    print("Nothing to draw.")
+    return "empty"
 
-    # with open(file_name, 'a') as f:
-    #     # f.write(str(key))
-    #     if type(key) == tuple:
-    #       f.write(str(type(key)))
-
-    # print(f"Content appended to '{file_name}'.")
-
-    # # Append another line
-    # another_entry = "Another log entry: Data updated at 2025-06-21 14:05:30\n"
-    # with open(file_name, 'a') as f:
-    #     f.write(another_entry)
-    # print(f"Another line appended to '{file_name}'.")
+  metrics = get_metrics()
 
-    # # Verify content (optional)
-    # with open(file_name, 'r') as f:
-    #     print("\nContent of the file:")
-    #     print(f.read())
+  # one pass over the keys for the min / max on both axes
+  with metrics.stage('decode'):
+    grid = MosaicGrid.from_dict(clean_data)
 
-    # x_coord = key[0]
-    # y_coord = key[1]
-    # shape = clean_data[key]
-    # print(f"Coordinates: {x_coord}")
-    # print(f"Coordinates: {x_coord}, {y_coord} - Shape: {shape}")
+  if export_path:
+    from mosaic_export import write_mosaic
+    with metrics.stage('export'):
+      write_mosaic(export_path, grid)
 
   # data meta
-  max_x_tup = max(clean_data.items(), key=lambda item: item[0][0])
-  max_x = max_x_tup[0][0]
-  print("max_x:", max_x)
-  
-  max_y_tup = max(clean_data.items(), key=lambda item: item[0][1])
-  max_y = max_y_tup[0][1]
-  print("max_y:", max_y)
-
-  for y in range(max_y + 1):
-    # print("y:", y)
-    for x in range(max_x):
-      # print(f"Coordinates: {x}, {y}")
-      if (x, y) in clean_data:
-        shape = clean_data[(x, y)]
-        # print(f"Coordinates: {x}, {y} - Shape: {shape}")
-        print(shape, end='')
-      else:
-        print(' ', end='')
-        
-    print("\n")
+  print("max_x:", grid.bounds.max_x)
+  print("max_y:", grid.bounds.max_y)
+
+  # full bounding box (last column included), from (0, 0) or the most
+  # negative coordinate; rows are written out in large batches
+  with metrics.stage('render'):
+    if window is not None:
+      written = render_rows(grid.iter_window(*window, sep=''), end="\n\n")
+    elif tile is not None:
+      written = render_tiles(grid.iter_tiles(*tile, sep=''), end="\n\n")
+    else:
+      written = render_rows(grid.iter_rows(sep=''), end="\n\n")
+  metrics.add('bytes_rendered', written)
 
   # matrix meta
   # for key in clean_data:
@@ -303,8 +535,9 @@ def draw_matrix(clean_data):
 
 # --- Run the script ---
 if __name__ == '__main__':
-    clean_data = get_document_table_contents(DOCUMENT_ID)
+    mosaics = get_document_table_contents(DOCUMENT_ID)
     
-    # print(clean_data)
+    # print(mosaics)
     
-    draw_matrix(clean_data)
\ No newline at end of file
+    for clean_data in mosaics or []:
+        draw_matrix(clean_data)
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""
+Buffered diagnostics log
+Off by default. Set GDOC_LOG_FILE to a path to enable it; the file is
+recreated once per run, when the log is first asked for (GDOC_LOG_ROTATE=1
+keeps the previous run as <path>.1), and entries are written in batches
+rather than one open/append per entry.
+"""
+
+import atexit
+import os
+
+DEFAULT_BATCH_SIZE = 4096
+
+
+class DiagnosticsLog:
+    """Collects log lines in memory and writes them out in batches"""
+
+    def __init__(self, file_name=None, rotate=False, batch_size=DEFAULT_BATCH_SIZE):
+        self.file_name = file_name
+        self.rotate = rotate
+        self.batch_size = batch_size
+        self.enabled = bool(file_name)
+        self._buffer = []
+        self._file = None
+
+    def _open(self):
+        if self.rotate and os.path.exists(self.file_name):
+            os.replace(self.file_name, self.file_name + '.1')
+        # Recreate the log for every run instead of appending forever
+        self._file = open(self.file_name, 'w', encoding='utf-8')
+
+    def write(self, line):
+        """Queue one line; does nothing when the log is disabled"""
+        if not self.enabled:
+            return
+        self._buffer.append(line)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        if self._file is None:
+            self._open()
+        self._file.write('\n'.join(self._buffer))
+        self._file.write('\n')
+        self._file.flush()
+        self._buffer.clear()
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_log = None
+
+
+def get_diagnostics_log():
+    """Return the process-wide diagnostics log, configured from the environment"""
+    global _log
+    if _log is None:
+        _log = DiagnosticsLog(
+            os.environ.get('GDOC_LOG_FILE'),
+            rotate=os.environ.get('GDOC_LOG_ROTATE') == '1',
+        )
+        if _log.enabled:
+            # recreate (or rotate) the file now, so a run that logs nothing
+            # leaves an empty log rather than the previous run's
+            _log._open()
+        atexit.register(_log.close)
+    return _log
@@ -0,0 +1,222 @@
+"""
+Published-doc fetch layer
+Reuses pooled HTTP connections across fetches and revalidates documents with
+ETag / Last-Modified so an unchanged doc is served from the parsed tables
+already held in memory or in the on-disk table cache.
+"""
+
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from fetch_scheduler import get_scheduler
+from html_tables import DEFAULT_BACKEND, DEFAULT_CHUNK_SIZE, iter_tables, response_encoding
+from metrics import get_metrics
+from table_cache import PUBLISHED, TablePacker, cache_key, get_table_cache
+
+# Set headers to mimic a browser request
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+DEFAULT_POOL_SIZE = 10
+
+# (connect, read) seconds; a stalled request then fails with requests.Timeout,
+# which the scheduler retries, instead of holding a slot forever
+DEFAULT_TIMEOUT = (10, 60)
+
+# Validators and parsed tables from the last successful fetch of a document
+CachedDoc = namedtuple('CachedDoc', ['etag', 'last_modified', 'tables'])
+
+
+class DocFetcher:
+    """Fetches published docs over one pooled session with conditional GETs"""
+
+    def __init__(self, session=None, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, cache=None, pool_block=False,
+                 scheduler=None, keep_tables=None):
+        self.session = session or requests.Session()
+        # With pool_block the pool size is a hard per-host concurrency limit
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=pool_block)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.timeout = timeout
+        # Optional TableCache; fresh entries skip the network entirely
+        self.cache = cache
+        # Retries, backoff and per-host rate limits - see fetch_scheduler.py
+        self.scheduler = scheduler or get_scheduler()
+        # With keep_tables=False nothing is held in memory between fetches;
+        # validators and tables for a 304 then come from the cache alone.
+        # By default tables are only kept when there is no cache.
+        self.keep_tables = cache is None if keep_tables is None else keep_tables
+
+        self._docs = {}
+        self._lock = threading.Lock()
+        self.not_modified = 0
+
+    def cached(self, doc_id):
+        """Return the CachedDoc held for a document ID, or None"""
+        with self._lock:
+            return self._docs.get(doc_id)
+
+    def _fresh_tables(self, doc_id):
+        if self.cache is None:
+            return None
+        return self.cache.load_fresh(cache_key(doc_id, PUBLISHED))
+
+    def _validators(self, doc_id):
+        entry = self.cached(doc_id)
+        if entry is None and self.cache is not None:
+            record = self.cache.entry(cache_key(doc_id, PUBLISHED))
+            if record is not None:
+                entry = CachedDoc(record['etag'], record['last_modified'], None)
+        return entry
+
+    def _conditional_headers(self, doc_id):
+        entry = self._validators(doc_id)
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def _remember(self, doc_id, response, tables, packer=None):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if packer is not None:
+            self.cache.store_packed(cache_key(doc_id, PUBLISHED), packer.finish(), etag, last_modified)
+        elif self.cache is not None:
+            self.cache.store(cache_key(doc_id, PUBLISHED), tables, etag, last_modified)
+        if not (etag or last_modified) or not self.keep_tables:
+            return
+        with self._lock:
+            self._docs[doc_id] = CachedDoc(etag, last_modified, tables)
+
+    def _forget(self, doc_id):
+        with self._lock:
+            self._docs.pop(doc_id, None)
+        if self.cache is not None:
+            self.cache.forget(cache_key(doc_id, PUBLISHED))
+
+    def _not_modified(self, doc_id):
+        """The tables to serve for a 304, or None if they are gone"""
+        entry = self.cached(doc_id)
+        if entry is None and self.cache is not None:
+            # Validators came from disk; the tables are still there too
+            tables = self.cache.load(cache_key(doc_id, PUBLISHED))
+            if tables is not None:
+                entry = CachedDoc(None, None, tables)
+        if entry is not None:
+            self.not_modified += 1
+            get_metrics().add('not_modified')
+            if self.cache is not None:
+                self.cache.touch(cache_key(doc_id, PUBLISHED))
+        return entry
+
+    def _get(self, url, headers, **kwargs):
+        """GET through the scheduler, rate limited per host and retried on 429 / 5xx"""
+        return self.scheduler.call(
+            urlsplit(url).netloc,
+            lambda: self.session.get(url, headers=headers, timeout=self.timeout, **kwargs),
+        )
+
+    def _get_document(self, doc_id, url, **kwargs):
+        """
+        Conditional GET for a document. Returns (entry, None) when the server
+        answered 304 and the tables are still held, else (None, response)
+        with a response that carries a body.
+        """
+        response = self._get(url, self._conditional_headers(doc_id), **kwargs)
+        if response.status_code != 304:
+            return None, response
+        response.close()
+        entry = self._not_modified(doc_id)
+        if entry is not None:
+            return entry, None
+
+        # The validators outlived their tables (entry evicted, deleted or
+        # corrupt) - drop them and ask once more for the full body
+        self._forget(doc_id)
+        response = self._get(url, {}, **kwargs)
+        if response.status_code == 304:
+            response.close()
+            # a 304 has no body to parse
+            raise requests.HTTPError("304 Not Modified for an unconditional request", response=response)
+        return None, response
+
+    def fetch_tables(self, doc_id, url, parse):
+        """
+        Returns the tables of a document, calling parse(response) only when
+        the server sends a new body.
+        """
+        tables = self._fresh_tables(doc_id)
+        if tables is not None:
+            return tables
+
+        entry, response = self._get_document(doc_id, url)
+        if entry is not None:
+            return entry.tables
+
+        response.raise_for_status()
+        get_metrics().add('bytes_fetched', len(response.content))
+        tables = parse(response)
+        self._remember(doc_id, response, tables)
+        return tables
+
+    def iter_tables(self, doc_id, url, chunk_size=DEFAULT_CHUNK_SIZE, backend=DEFAULT_BACKEND, store=True):
+        """
+        Yield the tables of a document while it streams in. Each table is
+        packed into the cache entry as it goes past, so only the compressed
+        entry builds up, not the tables themselves; with store=False nothing
+        is kept at all.
+        """
+        tables = self._fresh_tables(doc_id)
+        if tables is not None:
+            yield from tables
+            return
+
+        entry, response = self._get_document(doc_id, url, stream=True)
+        if entry is not None:
+            yield from entry.tables
+            return
+
+        with response:
+            response.raise_for_status()
+            chunks = _counted(response.iter_content(chunk_size=chunk_size), get_metrics())
+            packer = TablePacker() if store and self.cache is not None else None
+            tables = [] if store and self.keep_tables else None
+            for table in iter_tables(chunks, response_encoding(response), backend):
+                if packer is not None:
+                    packer.add(table)
+                if tables is not None:
+                    tables.append(table)
+                yield table
+        if store:
+            self._remember(doc_id, response, tables, packer)
+
+
+def _counted(chunks, metrics):
+    """Pass chunks through, adding their size to the bytes_fetched counter"""
+    if not metrics.enabled:
+        return chunks
+    return _count_chunks(chunks, metrics)
+
+
+def _count_chunks(chunks, metrics):
+    for chunk in chunks:
+        metrics.add('bytes_fetched', len(chunk))
+        yield chunk
+
+
+_fetcher = None
+
+
+def get_fetcher():
+    """Return the process-wide DocFetcher"""
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = DocFetcher(cache=get_table_cache())
+    return _fetcher
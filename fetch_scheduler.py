@@ -0,0 +1,223 @@
+"""
+Fetch scheduler
+Runs document fetches with retries and rate limits, so a 429 or 5xx costs
+one request a short wait instead of costing the whole run:
+
+- jittered exponential backoff between attempts, never shorter than the
+  server's Retry-After
+- a token bucket per host (or quota name); a throttled response pauses the
+  bucket so every thread sharing that quota backs off together
+- a cap on requests in flight across all hosts
+
+Configured from the environment:
+    GDOC_FETCH_RATE         requests per second per host (default 10)
+    GDOC_FETCH_BURST        bucket size (default 10)
+    GDOC_FETCH_CONCURRENCY  requests in flight at once (default 16)
+    GDOC_FETCH_ATTEMPTS     attempts per request, first one included (default 5)
+"""
+
+import email.utils
+import os
+import random
+import threading
+import time
+
+from metrics import get_metrics
+
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 10
+DEFAULT_CONCURRENCY = 16
+DEFAULT_ATTEMPTS = 5
+
+# Responses worth another attempt: rate limited or a transient server error
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# Longest single wait, whatever Retry-After says
+MAX_DELAY = 60.0
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After value (delta-seconds or HTTP-date), or None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, when.timestamp() - now)
+
+
+class RetryPolicy:
+    """How many attempts to make and how long to wait between them"""
+
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, base_delay=0.5, max_delay=MAX_DELAY, rng=None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = rng or random.Random()
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Wait before attempt number attempt + 1 (attempt counts from 0):
+        full jitter over an exponentially growing window, at least retry_after.
+        """
+        window = min(self.max_delay, self.base_delay * (2 ** attempt))
+        wait = self._rng.uniform(0, window)
+        if retry_after is not None:
+            wait = max(wait, retry_after)
+        return min(wait, self.max_delay)
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is free"""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """Take tokens (at most a full bucket), waiting as long as needed; returns the time waited"""
+        tokens = min(tokens, self.burst)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return waited
+                    wait = (tokens - self._tokens) / self.rate
+            self._sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next seconds (e.g. after a 429)"""
+        with self._lock:
+            now = self._clock()
+            self._paused_until = max(self._paused_until, now + seconds)
+            # start again from an empty bucket rather than a burst
+            self._tokens = 0.0
+            self._updated = max(self._updated, self._paused_until)
+
+
+def classify_requests(outcome):
+    """
+    Retry decision for requests: returns (retry, retry_after). outcome is a
+    Response or the exception the call raised.
+    """
+    if isinstance(outcome, BaseException):
+        import requests
+        return isinstance(outcome, (requests.ConnectionError, requests.Timeout)), None
+    if outcome.status_code in RETRY_STATUSES:
+        return True, parse_retry_after(outcome.headers.get('Retry-After'))
+    return False, None
+
+
+def classify_http_error(outcome):
+    """Retry decision for googleapiclient calls, which raise HttpError on failure"""
+    if not isinstance(outcome, BaseException):
+        return False, None
+    resp = getattr(outcome, 'resp', None)
+    if resp is None or getattr(resp, 'status', None) not in RETRY_STATUSES:
+        return False, None
+    return True, parse_retry_after(resp.get('retry-after'))
+
+
+class FetchScheduler:
+    """Rate-limited, retrying, concurrency-capped runner for fetch calls"""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, concurrency=DEFAULT_CONCURRENCY,
+                 policy=None, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.policy = policy or RetryPolicy()
+        self._sleep = sleep
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        """The token bucket for a host or quota name"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, sleep=self._sleep)
+            return bucket
+
+    def backoff(self, key, attempt, retry_after=None):
+        """Wait before retrying; a Retry-After also pauses everyone on key"""
+        metrics = get_metrics()
+        if retry_after is not None:
+            # the quota is shared - everyone on this key waits it out
+            self.bucket(key).pause(retry_after)
+            metrics.add('throttled')
+        metrics.add('retries')
+        self._sleep(self.policy.delay(attempt, retry_after))
+
+    def call(self, key, func, classify=classify_requests, cost=1):
+        """
+        Run func() under key's rate limit, retrying while classify says so.
+        cost is the number of requests func makes (e.g. a batch). The last
+        attempt's response is returned (or its exception raised) even if it
+        was still retryable, so callers see the real status.
+        """
+        bucket = self.bucket(key)
+        attempt = 0
+        while True:
+            bucket.acquire(cost)
+            with self._slots:
+                try:
+                    outcome = func()
+                except Exception as exc:
+                    outcome = exc
+
+            retry, retry_after = classify(outcome)
+            if not retry or attempt + 1 >= self.policy.attempts:
+                if isinstance(outcome, BaseException):
+                    raise outcome
+                return outcome
+
+            close = getattr(outcome, 'close', None)
+            if close is not None and not isinstance(outcome, BaseException):
+                close()
+            self.backoff(key, attempt, retry_after)
+            attempt += 1
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide FetchScheduler, configured from the environment"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FetchScheduler(
+                rate=float(os.environ.get('GDOC_FETCH_RATE', DEFAULT_RATE)),
+                burst=int(os.environ.get('GDOC_FETCH_BURST', DEFAULT_BURST)),
+                concurrency=int(os.environ.get('GDOC_FETCH_CONCURRENCY', DEFAULT_CONCURRENCY)),
+                policy=RetryPolicy(attempts=int(os.environ.get('GDOC_FETCH_ATTEMPTS', DEFAULT_ATTEMPTS))),
+            )
+        return _scheduler
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Command line entry point
+One CLI for the scrape / decode scripts. Only argparse and the stdlib are
+loaded up front; each command imports what its code path needs, and a
+document served from a warm table cache never loads the network (requests,
+googleapiclient) or HTML parser (bs4, lxml) stacks.
+
+    python gdoc_cli.py scrape <url> [--parallel] [--window X0 Y0 X1 Y1 | --tile W H] [--export PATH]
+                              [--output PATH [--mmap]]
+    python gdoc_cli.py batch <file of URLs | ->
+    python gdoc_cli.py incremental <url>
+    python gdoc_cli.py decode [document_id] [--parallel]
+    python gdoc_cli.py export <url | document_id> <path> [--api] [--format FORMAT] [--batch-rows N]
+    python gdoc_cli.py serve [--host HOST] [--port N] [--max-entries N] [--max-bytes N] [--ttl S]
+
+Options before the command:
+    --metrics FILE              write per-stage timings and counters (see metrics.py)
+    --metrics-format FORMAT     'jsonl' or 'prometheus' (default: from FILE's extension)
+    --profile FILE              run under cProfile and dump the stats to FILE
+
+Measure startup with: python benchmark.py startup
+"""
+
+import argparse
+import sys
+
+
+def cmd_scrape(args):
+    """Scrape a published doc and render each table's mosaic"""
+    from gdoc_scrape_0 import display_table_info, stream_google_doc_tables
+
+    if 'docs.google.com' not in args.url:
+        print("Error: Please provide a valid Google Docs URL")
+        return 1
+
+    if args.mmap and not args.output:
+        print("Error: --mmap needs --output")
+        return 1
+
+    options = {'window': args.window, 'tile': args.tile, 'export_path': args.export,
+               'output': args.output, 'use_mmap': args.mmap}
+    tables = stream_google_doc_tables(args.url, backend=args.backend)
+    if args.parallel:
+        tables = list(tables)
+        display_table_info(tables, parallel=True, **options)
+        found = bool(tables)
+    else:
+        # render each table as soon as it has been parsed
+        found = False
+        for i, table in enumerate(tables):
+            found = True
+            # keep the per-table file names display_table_info would use
+            if args.export or args.output:
+                from mosaic_export import export_path_for
+                if args.export:
+                    options['export_path'] = export_path_for(args.export, i)
+                if args.output:
+                    options['output'] = export_path_for(args.output, i)
+            display_table_info([table], **options)
+
+    if not found:
+        print("No tables found or unable to access the document.")
+        return 1
+    return 0
+
+
+def cmd_batch(args):
+    """Scrape every URL listed in a file (or stdin)"""
+    from gdoc_scrape_0 import main_batch
+    main_batch(args.source)
+    return 0
+
+
+def cmd_incremental(args):
+    """Print the per-table deltas since the last run of a document"""
+    from gdoc_scrape_0 import main_incremental
+    main_incremental(args.url)
+    return 0
+
+
+def cmd_decode(args):
+    """Read a document through the Docs API and draw each table's mosaic"""
+    import decode_doc
+
+    mosaics = decode_doc.get_document_table_contents(args.document_id or decode_doc.DOCUMENT_ID, parallel=args.parallel)
+    if mosaics is None:
+        return 1
+    for clean_data in mosaics:
+        decode_doc.draw_matrix(clean_data)
+    return 0
+
+
+def cmd_export(args):
+    """Stream the rows of every table to a CSV / JSON lines / Arrow / Parquet file"""
+    from table_export import export_tables
+
+    if args.api:
+        from decode_doc import get_documents_tables
+        try:
+            tables = get_documents_tables([args.source])[args.source]
+        except FileNotFoundError as e:
+            # no service account key file
+            print(f"Error: {e}")
+            return 1
+        except Exception as e:
+            print(f"Error fetching document, {args.path} not written: {e}")
+            return 1
+        if isinstance(tables, Exception):
+            print(f"An HTTP error occurred: {tables}")
+            return 1
+    else:
+        from gdoc_scrape_0 import stream_google_doc_tables
+        if 'docs.google.com' not in args.source:
+            print("Error: Please provide a valid Google Docs URL")
+            return 1
+        # tables are written as they are parsed and not kept for the cache;
+        # a failed fetch raises, so export_tables leaves args.path as it was
+        tables = stream_google_doc_tables(args.source, store=False, raise_errors=True)
+
+    try:
+        written = export_tables(tables, args.path, args.format, args.batch_rows)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    except Exception as e:
+        print(f"Error fetching document, {args.path} not written: {e}")
+        return 1
+    print(f"Exported {written} rows to {args.path}")
+    return 0
+
+
+def cmd_serve(args):
+    """Serve tables, decoded cells and rendered mosaics over HTTP (see mosaic_service.py)"""
+    from mosaic_service import DocumentService, LRUCache, make_server
+
+    cache = LRUCache(args.max_entries, args.max_bytes, args.ttl)
+    server = make_server(args.host, args.port, DocumentService(cache))
+    print(f"Serving on http://{args.host}:{server.server_address[1]}/docs/<document_id>/tables|cells|mosaic")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def positive_int(value):
+    """argparse type for sizes: an int of at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--metrics', metavar='FILE', help='write per-stage timings and counters to FILE')
+    parser.add_argument('--metrics-format', choices=('jsonl', 'prometheus'))
+    parser.add_argument('--profile', metavar='FILE', help='run under cProfile and dump the stats to FILE')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scrape = subparsers.add_parser('scrape', help='scrape a published doc and render its mosaics')
+    scrape.add_argument('url')
+    scrape.add_argument('--backend', default='html.parser', choices=('html.parser', 'lxml', 'auto'))
+    scrape.add_argument('--parallel', action='store_true', help='decode and render tables on a process pool')
+    view = scrape.add_mutually_exclusive_group()
+    view.add_argument('--window', type=int, nargs=4, metavar=('X0', 'Y0', 'X1', 'Y1'))
+    view.add_argument('--tile', type=positive_int, nargs=2, metavar=('W', 'H'))
+    scrape.add_argument('--export', metavar='PATH', help='also write each mosaic as a binary mosaic file')
+    scrape.add_argument('--output', metavar='PATH',
+                        help="write the rendered mosaics to PATH (PATH.1, ... or '{table}' in PATH for later tables)")
+    scrape.add_argument('--mmap', action='store_true', help='write --output through a memory map')
+    scrape.set_defaults(func=cmd_scrape)
+
+    batch = subparsers.add_parser('batch', help='scrape many published docs concurrently')
+    batch.add_argument('source', help="file of URLs, one per line, or '-' for stdin")
+    batch.set_defaults(func=cmd_batch)
+
+    incremental = subparsers.add_parser('incremental', help='report what changed since the last run')
+    incremental.add_argument('url')
+    incremental.set_defaults(func=cmd_incremental)
+
+    decode = subparsers.add_parser('decode', help='decode a document through the Docs API')
+    decode.add_argument('document_id', nargs='?')
+    decode.add_argument('--parallel', action='store_true', help='decode tables on a process pool')
+    decode.set_defaults(func=cmd_decode)
+
+    export = subparsers.add_parser('export', help='stream table rows to CSV / JSON lines / Arrow / Parquet')
+    export.add_argument('source', help='published doc URL, or a document ID with --api')
+    export.add_argument('path', help='output file; the extension picks the format unless --format is given')
+    export.add_argument('--api', action='store_true', help='read the document through the Docs API')
+    export.add_argument('--format', choices=('csv', 'jsonl', 'arrow', 'parquet'))
+    export.add_argument('--batch-rows', type=int, default=65536, help='rows written per batch')
+    export.set_defaults(func=cmd_export)
+
+    serve = subparsers.add_parser('serve', help='serve decoded documents over HTTP')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--max-entries', type=int, default=256, help='documents kept in memory')
+    serve.add_argument('--max-bytes', type=int, default=256 * 1024 * 1024, help='approximate memory for kept documents')
+    serve.add_argument('--ttl', type=float, default=300, help='seconds a kept document is served before refetching')
+    serve.set_defaults(func=cmd_serve)
+
+    return parser
+
+
+def run_profiled(func, args, path):
+    """Run func(args) under cProfile, dump the stats to path and summarise them"""
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, args)
+    finally:
+        profiler.dump_stats(path)
+        print(f"\nProfile written to {path} - top functions by cumulative time:", file=sys.stderr)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(15)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.metrics:
+        from metrics import configure_metrics
+        configure_metrics(args.metrics, args.metrics_format)
+    if args.profile:
+        return run_profiled(args.func, args, args.profile)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,14 +2,25 @@
 """
 Google Docs Table Scraper
 Scrapes tabular data from publicly available Google Docs and displays it in tabular format.
+
+The network (requests, doc_fetch) and parser (bs4, html_tables) stacks are
+imported only on the code paths that need them, so a run served from a warm
+table cache never loads them.
 """
 
-import requests
-from bs4 import BeautifulSoup
+import io
 import re
-from tabulate import tabulate
 import sys
 
+from metrics import get_metrics
+from table_cache import PUBLISHED, cache_key, get_table_cache
+from mosaic_grid import MosaicGrid, decode_mosaic_rows
+from mosaic_render import render_rows, render_to_file, tile_lines, write_rendered
+from table_model import TableBuilder, span_value
+
+# html_tables.DEFAULT_BACKEND, without importing the parser stack
+DEFAULT_BACKEND = 'html.parser'
+
 def extract_document_id(url):
     """Extract document ID from Google Docs URL"""
     # Pattern for published docs: /d/e/DOCUMENT_ID/pub
@@ -39,69 +50,101 @@ def convert_to_public_url(url):
         # Try to convert edit URL to public format
         return f"https://docs.google.com/document/d/{doc_id}/export?format=html"
 
-def scrape_google_doc_tables(url):
-    """Scrape tables from a publicly available Google Doc"""
-    try:
-        # Convert URL to public format if needed
-        public_url = convert_to_public_url(url)
-        if not public_url:
-            print("Error: Could not extract document ID from URL")
-            return []
+def parse_html_tables(html):
+    """Extract every table in an HTML document as a list of row lists"""
+    from bs4 import BeautifulSoup
+
+    # Parse HTML
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    # Find all tables
+    tables = soup.find_all('table')
+    
+    extracted_tables = []
+    
+    for i, table in enumerate(tables):
         
-        # print(f"Fetching document from: {public_url}")
+        # Extract table data
+        builder = TableBuilder()
+        rows = table.find_all('tr')
         
-        # Set headers to mimic a browser request
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+        for row in rows:
+            builder.start_row()
+            # Get all cells (td and th)
+            cells = row.find_all(['td', 'th'])
+            
+            for cell in cells:
+                # Get text content and clean it
+                cell_text = cell.get_text(strip=True)
+                # Handle merged cells (colspan/rowspan) - spanned
+                # positions are filled with '' by the builder
+                colspan = span_value(cell.get('colspan'))
+                rowspan = span_value(cell.get('rowspan'))
+                
+                # Add the cell content
+                builder.add_cell(cell_text, colspan, rowspan)
         
-        # Fetch the document
-        response = requests.get(public_url, headers=headers)
-        response.raise_for_status()
+        # Empty rows are dropped by the builder
+        table_data = builder.finish()
         
-        # Parse HTML
-        soup = BeautifulSoup(response.content, 'html.parser')
+        if table_data:
+            extracted_tables.append(table_data)
         
-        # Find all tables
-        tables = soup.find_all('table')
+    return extracted_tables
+
+def parse_tables(response, backend='bs4'):
+    """Parse the tables out of a fetched document with the chosen backend"""
+    with get_metrics().stage('parse'):
+        if backend == 'bs4':
+            return parse_html_tables(response.content)
+        # single-pass event-stream backends - see html_tables.py
+        from html_tables import parse_html, response_encoding
+        return parse_html(response.content, response_encoding(response), backend)
+
+def scrape_google_doc_tables(url, backend='bs4'):
+    """
+    Scrape tables from a publicly available Google Doc.
+    backend is 'bs4' (BeautifulSoup tree), 'html.parser', 'lxml' or 'auto'.
+    Every backend returns the tables in the order they open; for a table
+    with another nested in it, bs4 also lists the nested table's rows and
+    cells among its own, the streaming backends do not.
+    """
+    # Convert URL to public format if needed
+    public_url = convert_to_public_url(url)
+    if not public_url:
+        print("Error: Could not extract document ID from URL")
+        return []
+    
+    metrics = get_metrics()
+    
+    # a fresh cache entry skips the network and parser imports altogether
+    with metrics.stage('cache'):
+        extracted_tables = get_table_cache().load_fresh(cache_key(extract_document_id(url), PUBLISHED))
+    if extracted_tables is not None:
+        metrics.add('cache_hits')
+        metrics.count_tables(extracted_tables)
+        return extracted_tables
+    
+    import requests
+    from doc_fetch import get_fetcher
+    
+    try:
+        # print(f"Fetching document from: {public_url}")
+        
+        # Fetch the document over the shared session; an unchanged document
+        # (304 Not Modified) comes back as the tables parsed last time
+        with metrics.stage('fetch'):
+            extracted_tables = get_fetcher().fetch_tables(
+                extract_document_id(url),
+                public_url,
+                lambda response: parse_tables(response, backend),
+            )
+        metrics.count_tables(extracted_tables)
         
-        if not tables:
+        if not extracted_tables:
             print("No tables found in the document.")
             return []
         
-        extracted_tables = []
-        
-        for i, table in enumerate(tables):
-            
-            # Extract table data
-            table_data = []
-            rows = table.find_all('tr')
-            
-            for row in rows:
-                # Get all cells (td and th)
-                cells = row.find_all(['td', 'th'])
-                row_data = []
-                
-                for cell in cells:
-                    # Get text content and clean it
-                    cell_text = cell.get_text(strip=True)
-                    # Handle merged cells (colspan/rowspan)
-                    colspan = int(cell.get('colspan', 1))
-                    rowspan = int(cell.get('rowspan', 1))
-                    
-                    # Add the cell content
-                    row_data.append(cell_text)
-                    
-                    # Add empty cells for colspan > 1
-                    for _ in range(colspan - 1):
-                        row_data.append('')
-                
-                if row_data:  # Only add non-empty rows
-                    table_data.append(row_data)
-            
-            if table_data:
-                extracted_tables.append(table_data)
-            
         return extracted_tables
         
     except requests.exceptions.RequestException as e:
@@ -111,6 +154,57 @@ def scrape_google_doc_tables(url):
         print(f"Error processing document: {e}")
         return []
 
+def stream_google_doc_tables(url, backend=DEFAULT_BACKEND, store=True, raise_errors=False):
+    """
+    Yield tables from a publicly available Google Doc while it downloads.
+    Download and parsing are interleaved, so they are timed together as the
+    'stream' stage. store=False skips keeping the tables for the table
+    cache (for documents too large to hold whole). Errors are printed and
+    end the stream early, unless raise_errors is set, in which case they
+    are raised to the caller.
+    """
+    public_url = convert_to_public_url(url)
+    if not public_url:
+        if raise_errors:
+            raise ValueError("Could not extract document ID from URL")
+        print("Error: Could not extract document ID from URL")
+        return
+
+    metrics = get_metrics()
+
+    # a fresh cache entry skips the network and parser imports altogether
+    with metrics.stage('cache'):
+        tables = get_table_cache().load_fresh(cache_key(extract_document_id(url), PUBLISHED))
+    if tables is not None:
+        metrics.add('cache_hits')
+        metrics.count_tables(tables)
+        yield from tables
+        return
+
+    import requests
+    from doc_fetch import get_fetcher
+
+    try:
+        # Read the body in chunks and hand back each table as it closes
+        tables = get_fetcher().iter_tables(extract_document_id(url), public_url, backend=backend, store=store)
+        while True:
+            # only time the generator itself, not the caller between tables
+            with metrics.stage('stream'):
+                table = next(tables, None)
+            if table is None:
+                break
+            metrics.count_tables([table])
+            yield table
+
+    except requests.exceptions.RequestException as e:
+        if raise_errors:
+            raise
+        print(f"Error fetching document: {e}")
+    except Exception as e:
+        if raise_errors:
+            raise
+        print(f"Error processing document: {e}")
+
 # def display_tables(tables):
 #     """Display tables in formatted output"""
 #     if not tables:
@@ -152,101 +246,89 @@ def scrape_google_doc_tables(url):
         
 #         print(f"\nTable dimensions: {len(normalized_data)} rows × {max_cols} columns")
 
-def display_table_info(tables):
-    for i, table_data in enumerate(tables):
-        if not table_data:
-            print("Empty table")
-            continue
-        
-        # Find the maximum number of columns
-        max_cols = max(len(row) for row in table_data) if table_data else 0
-        
-        # Normalize all rows to have the same number of columns
-        normalized_data = []
-        for row in table_data:
-            # Pad rows with empty strings if they have fewer columns
-            padded_row = row + [''] * (max_cols - len(row))
-            normalized_data.append(padded_row)
-        
-        # # Display using tabulate for better formatting
-        # try:
-        #     # Try to use first row as headers if it looks like headers
-        #     if len(normalized_data) > 1:
-        #         headers = normalized_data[0]
-        #         data = normalized_data[1:]
-        #         print(tabulate(data, headers=headers, tablefmt='grid'))
-        #     else:
-        #         print(tabulate(normalized_data, tablefmt='grid'))
-        # except:
-        #     # Fallback to simple display
-        #     for j, row in enumerate(normalized_data):
-        #         print(f"Row {j + 1}: {' | '.join(str(cell) for cell in row)}")
+def render_table(table_data, index=0, window=None, tile=None, export_path=None, out=None,
+                 output=None, use_mmap=False):
+    """
+    Decode one table and render its mosaic to out (default: stdout).
+    Returns False for an empty table. See display_table_info for the options.
+    """
+    if not table_data:
+        return False
+    
+    metrics = get_metrics()
+    
+    # extract & prepare data for display - one pass over the rows,
+    # header skipped, bounds tracked as the grid is filled
+    with metrics.stage('decode'):
+        grid = MosaicGrid.from_cells(decode_mosaic_rows(table_data))
+    metrics.add('cells_decoded', len(grid))
+    
+    if export_path:
+        from mosaic_export import export_path_for, write_mosaic
+        with metrics.stage('export'):
+            write_mosaic(export_path_for(export_path, index), grid)
         
-        # print(f"\nTable dimensions: {len(normalized_data)} rows × {max_cols} columns")
+    ################
+    # Display Mosaix - rows are written in large buffered batches
+    #
+    with metrics.stage('render'):
+        if window is not None:
+            rows = grid.iter_window(*window)
+        elif tile is not None:
+            rows = tile_lines(grid.iter_tiles(*tile))
+        else:
+            rows = grid.iter_rows()
+        if output:
+            from mosaic_export import export_path_for
+            written = render_to_file(rows, export_path_for(output, index), use_mmap=use_mmap)
+        else:
+            written = render_rows(rows, out)
+    metrics.add('bytes_rendered', written)
+    return True
 
+def _render_table_bytes(table_data, index, window, tile, export_path, output, use_mmap):
+    """Process-pool worker: the rendered mosaic as bytes (b'' if written to output), or None if empty"""
+    out = io.BytesIO()
+    if not render_table(table_data, index, window, tile, export_path, out, output, use_mmap):
+        return None
+    return out.getvalue()
+
+def display_table_info(tables, window=None, tile=None, export_path=None, parallel=False, max_workers=None,
+                       output=None, use_mmap=False):
+    """
+    Render each table's mosaic. window=(x0, y0, x1, y1) renders only that
+    region (x0 <= x < x1, y0 <= y < y1); tile=(width, height) renders the
+    mosaic as fixed-size tiles, skipping empty ones. With export_path each
+    decoded mosaic is also written as a binary mosaic file (mosaic_export).
+    With output the rendered mosaics go to files (one per table, named as
+    for export_path) instead of stdout, through a memory map if use_mmap.
+    With parallel=True the tables are decoded and rendered on a process
+    pool; the output is still written in document order.
+    """
+    if parallel and len(tables) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        count = len(tables)
+        # the workers' own stages are not reported back - time the pool as a whole
+        with get_metrics().stage('decode_render_pool'), \
+             ProcessPoolExecutor(max_workers=max_workers) as pool:
+            # map hands results back in submission order
+            rendered = pool.map(
+                _render_table_bytes, tables, range(count),
+                [window] * count, [tile] * count, [export_path] * count,
+                [output] * count, [use_mmap] * count,
+            )
+            for data in rendered:
+                if data is None:
+                    print("Empty table")
+                else:
+                    write_rendered(data)
+        return
+    
     for i, table_data in enumerate(tables):
         
-        if not table_data:
+        if not render_table(table_data, i, window, tile, export_path, output=output, use_mmap=use_mmap):
             print("Empty table")
             continue
-        
-        # Find the maximum number of columns
-        max_cols = max(len(row) for row in table_data) if table_data else 0
-        
-        # Normalize all rows to have the same number of columns
-        normalized_data = []
-        for row in table_data:
-            # Pad rows with empty strings if they have fewer columns
-            padded_row = row + [''] * (max_cols - len(row))
-            normalized_data.append(padded_row)
-        
-        # print(f"Normalized data: {normalized_data}")
-        pic_info = {}
-        
-        # remove first line - Header Info
-        normalized_data.pop(0)
-        
-        # extract & prepare data for display
-        num_entries = len(normalized_data)
-        max_x = 0
-        max_y = 0
-        for i in range(num_entries):
-            # print("i:", i)
-            # print(f"Normalized data: {normalized_data[i]}")
-            # print(f"x: {normalized_data[1][0]}")
-            # print(f"y: {normalized_data[1][2]}")
-            # print(f"symbol: {normalized_data[1][1]}")
-            
-            x_loc = int(normalized_data[i][0])
-            if x_loc > max_x:
-                max_x = x_loc
-                
-            y_loc = int(normalized_data[i][2])
-            if y_loc > max_y:
-                max_y = y_loc
-                
-            loc_info = (x_loc, y_loc)
-            # print(loc_info)
-            
-            pic_info[loc_info] = normalized_data[i][1]       
-        
-        # print(f"Pick info: {pic_info}")
-        # print(f"Max X: {max_x}, Max Y: {max_y}")
-            
-        ################
-        # Display Mosaix
-        #
-        m_cols = max_x + 1
-        m_rows = max_y + 1
-        
-        for y in range(m_rows):
-            row_display = []
-            for x in range(m_cols):
-                # Get the symbol for the current location
-                symbol = pic_info.get((x, y), ' ')
-                row_display.append(symbol)
-            # display the row
-            print(' '.join(row_display))
             
             
         # show message
@@ -270,9 +352,100 @@ def display_table_info(tables):
         
         # print(f"\nTable dimensions: {len(normalized_data)} rows × {max_cols} columns")
 
+def read_url_list(source):
+    """Read URLs, one per line, from a file path or '-' for stdin"""
+    if source == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    
+    # skip blank lines and comments
+    return [line.strip() for line in lines if line.strip() and not line.lstrip().startswith('#')]
+
+def scrape_batch(urls, max_workers=16, per_host=8, parse_workers=None):
+    """
+    Scrape many published docs concurrently.
+    Fetches run on a thread pool with at most per_host connections to any
+    one host; HTML parsing runs on a process pool. Yields (url, tables, error)
+    in order of completion.
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+    from doc_fetch import DocFetcher
+    from html_tables import parse_html, response_encoding
+    
+    fetcher = DocFetcher(pool_size=per_host, pool_block=True, cache=get_table_cache())
+    
+    with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+         ThreadPoolExecutor(max_workers=max_workers) as fetch_pool:
+        
+        def parse(response):
+            return parse_pool.submit(parse_html, response.content, response_encoding(response)).result()
+        
+        def fetch(url):
+            public_url = convert_to_public_url(url)
+            if not public_url:
+                raise ValueError("Could not extract document ID from URL")
+            return fetcher.fetch_tables(extract_document_id(url), public_url, parse)
+        
+        futures = {fetch_pool.submit(fetch, url): url for url in urls}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], [], e
+
+def main_batch(source):
+    """Scrape every URL listed in source and display results as they finish"""
+    urls = read_url_list(source)
+    if not urls:
+        print("Error: No URLs provided")
+        return
+    
+    for url, tables, error in scrape_batch(urls):
+        print(f"\nProcessing URL: {url}\n")
+        if error is not None:
+            print(f"Error fetching document: {error}")
+        elif not tables:
+            print("No tables found in the document.")
+        else:
+            display_table_info(tables)
+
+def main_incremental(url):
+    """Re-scrape a document and report only what changed since the last run"""
+    doc_id = extract_document_id(url)
+    if not doc_id:
+        print("Error: Could not extract document ID from URL")
+        return
+    
+    from mosaic_delta import DeltaStore, delta_to_json
+    
+    tables = list(stream_google_doc_tables(url))
+    
+    # one JSON line per table: inserted / removed / changed rows and the
+    # re-rendered display rows they touch
+    for delta in DeltaStore().update(doc_id, tables):
+        print(delta_to_json(delta))
+
 def main():
     """Main function"""
 
+    # Batch mode: gdoc_scrape_0.py --batch <file of URLs | ->
+    if len(sys.argv) > 2 and sys.argv[1] == '--batch':
+        main_batch(sys.argv[2])
+        return
+
+    # Incremental mode: gdoc_scrape_0.py --incremental <url>
+    if len(sys.argv) > 2 and sys.argv[1] == '--incremental':
+        main_incremental(sys.argv[2])
+        return
+
+    # Parallel mode: gdoc_scrape_0.py --parallel <url> - every table of the
+    # document is decoded and rendered on a process pool
+    parallel = len(sys.argv) > 1 and sys.argv[1] == '--parallel'
+    if parallel:
+        del sys.argv[1]
+
     # Get URL from user
     if len(sys.argv) > 1:
         url = sys.argv[1]
@@ -289,13 +462,18 @@ def main():
     
     print(f"\nProcessing URL: {url}\n")
     
-    # Scrape tables
-    tables = scrape_google_doc_tables(url)
-    
-    # Display results
-    if tables:
-        display_table_info(tables)
+    # Scrape tables, rendering each one as soon as it has been parsed
+    found = False
+    if parallel:
+        tables = list(stream_google_doc_tables(url))
+        found = bool(tables)
+        display_table_info(tables, parallel=True)
     else:
+        for table in stream_google_doc_tables(url):
+            found = True
+            display_table_info([table])
+
+    if not found:
         print("\nNo tables found or unable to access the document.")
         print("\nTroubleshooting tips:")
         print("1. Make sure the document is publicly accessible")
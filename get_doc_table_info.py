@@ -5,6 +5,8 @@ from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from diagnostics import get_diagnostics_log
+
 # --- Configuration ---
 SCOPES = [
     'https://www.googleapis.com/auth/documents.readonly',
@@ -150,15 +152,16 @@ def get_document_table_contents(document_id):
         new_dict_no_str_keys = {}
         key_type_to_strip = str
 
-        file_name="./gdoc_log.txt"
+        # buffered & off by default - see diagnostics.py
+        log = get_diagnostics_log()
 
         for key, value in mosaic_data.items():
             if not isinstance(key, key_type_to_strip):
                 if len(key) > 0:
                   new_dict_no_str_keys[key] = value          
-                with open(file_name, 'a') as f:
-                    f.write(str(key))
-                    # f.write(str(type(key)))
+                if log.enabled:
+                    log.write(str(key))
+        log.flush()
         
         # file_name="./gdoc_log.txt"
         # for key in new_dict_no_str_keys:
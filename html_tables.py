@@ -0,0 +1,232 @@
+"""
+Incremental HTML table extraction
+Pulls <table> contents out of a published Google Doc while the HTML is still
+arriving, without building a full document tree. Rows and cell text are
+collected in a single pass over the parser's event stream, using either the
+stdlib html.parser or lxml when it is installed.
+"""
+
+import codecs
+from collections import deque
+from html.parser import HTMLParser
+
+from table_model import TableBuilder, span_value
+
+try:
+    from lxml import etree
+except ImportError:  # lxml is optional; html.parser is always available
+    etree = None
+
+# Size of each chunk read from a streamed response
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+CELL_TAGS = ('td', 'th')
+
+# 'html.parser' (stdlib), 'lxml', or 'auto' to prefer lxml when installed
+DEFAULT_BACKEND = 'html.parser'
+
+
+class TableCollector:
+    """
+    Builds tables from start / end / data events. The method names follow
+    lxml's parser target interface so the same object serves both backends.
+    Tables come out in the order they open, as with BeautifulSoup's
+    find_all: a table nested in another is released with its outermost
+    table, after the tables enclosing it.
+    """
+
+    def __init__(self):
+        # One entry per open <table>; nested tables get their own entry
+        self._stack = []
+        # Grids of the outermost open table and the tables inside it, by
+        # opening order; None until each one closes
+        self._pending = []
+        # Text seen since the last tag; stripped as one piece like get_text(strip=True)
+        self._text = []
+        self.finished = deque()
+
+    def start(self, tag, attrs):
+        self._flush_text()
+        if tag == 'table':
+            self._stack.append({
+                'builder': TableBuilder(), 'cell': None, 'colspan': 1, 'rowspan': 1,
+                'slot': len(self._pending),
+            })
+            self._pending.append(None)
+            return
+        if not self._stack:
+            return
+
+        table = self._stack[-1]
+        if tag == 'tr':
+            self._close_cell(table)
+            table['builder'].start_row()
+        elif tag in CELL_TAGS:
+            self._close_cell(table)
+            table['cell'] = []
+            table['colspan'] = span_value(attrs.get('colspan'))
+            table['rowspan'] = span_value(attrs.get('rowspan'))
+
+    def end(self, tag):
+        self._flush_text()
+        if not self._stack:
+            return
+
+        table = self._stack[-1]
+        if tag == 'table':
+            self._close_cell(table)
+            self._stack.pop()
+            self._pending[table['slot']] = table['builder'].finish()
+            if not self._stack:
+                self._release()
+        elif tag == 'tr':
+            self._close_cell(table)
+            table['builder'].end_row()
+        elif tag in CELL_TAGS:
+            self._close_cell(table)
+
+    def data(self, data):
+        if self._stack:
+            self._text.append(data)
+
+    def close(self):
+        self._flush_text()
+        # tables still open at the end of the document end there, as in
+        # bs4 and lxml
+        while self._stack:
+            self.end('table')
+
+    def _release(self):
+        self.finished.extend(grid for grid in self._pending if grid)
+        self._pending.clear()
+
+    def _flush_text(self):
+        if not self._text:
+            return
+        stripped = ''.join(self._text).strip()
+        self._text.clear()
+        if not stripped:
+            return
+        # Text inside a nested table also belongs to the enclosing cells
+        for table in self._stack:
+            if table['cell'] is not None:
+                table['cell'].append(stripped)
+
+    def _close_cell(self, table):
+        if table['cell'] is None:
+            return
+        # Spanned positions are filled with '' by the builder
+        table['builder'].add_cell(''.join(table['cell']), table['colspan'], table['rowspan'])
+        table['cell'] = None
+
+    def pop_tables(self):
+        """Yield and discard every table finished so far"""
+        while self.finished:
+            yield self.finished.popleft()
+
+
+class TableStreamParser(HTMLParser):
+    """Stdlib html.parser backend feeding a TableCollector"""
+
+    def __init__(self, encoding='utf-8'):
+        super().__init__(convert_charrefs=True)
+        self.collector = TableCollector()
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, dict(attrs))
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+    def feed(self, chunk):
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        if chunk:
+            super().feed(chunk)
+
+    def close(self):
+        tail = self._decoder.decode(b'', final=True)
+        if tail:
+            super().feed(tail)
+        super().close()
+        self.collector.close()
+
+    def pop_tables(self):
+        return self.collector.pop_tables()
+
+
+class LxmlTableParser:
+    """lxml backend: libxml2's HTML parser driving a TableCollector as its target"""
+
+    def __init__(self, encoding='utf-8'):
+        self.collector = TableCollector()
+        self._parser = etree.HTMLParser(target=self.collector, encoding=encoding)
+
+    def feed(self, chunk):
+        if chunk:
+            self._parser.feed(chunk)
+
+    def close(self):
+        self._parser.close()
+
+    def pop_tables(self):
+        return self.collector.pop_tables()
+
+
+def available_backends():
+    """Names of the streaming backends usable in this environment"""
+    backends = ['html.parser']
+    if etree is not None:
+        backends.append('lxml')
+    return backends
+
+
+def make_parser(backend=DEFAULT_BACKEND, encoding='utf-8'):
+    """Return an incremental table parser for the named backend"""
+    if backend == 'auto':
+        backend = 'lxml' if etree is not None else 'html.parser'
+    if backend == 'html.parser':
+        return TableStreamParser(encoding)
+    if backend == 'lxml':
+        if etree is None:
+            raise ValueError("The lxml backend needs lxml installed")
+        return LxmlTableParser(encoding)
+    raise ValueError(f"Unknown HTML parser backend: {backend}")
+
+
+def iter_tables(chunks, encoding='utf-8', backend=DEFAULT_BACKEND):
+    """Yield each table from an iterable of HTML chunks as soon as it closes"""
+    parser = make_parser(backend, encoding)
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from parser.pop_tables()
+    parser.close()
+    yield from parser.pop_tables()
+
+
+def parse_html(html, encoding='utf-8', backend=DEFAULT_BACKEND):
+    """
+    Return every table in a complete HTML document (str or bytes), in the
+    order they open. A table's rows are its own: unlike the bs4 path, a
+    table wrapped around another does not also get the inner table's rows.
+    """
+    return list(iter_tables([html], encoding=encoding, backend=backend))
+
+
+def response_encoding(response):
+    """Return the charset a requests response declares, defaulting to UTF-8"""
+    # Only trust an explicit charset; requests guesses ISO-8859-1 for text/html
+    content_type = response.headers.get('Content-Type', '')
+    if 'charset' in content_type.lower() and response.encoding:
+        return response.encoding
+    return 'utf-8'
+
+
+def iter_response_tables(response, chunk_size=DEFAULT_CHUNK_SIZE, backend=DEFAULT_BACKEND):
+    """Yield tables from a requests response opened with stream=True"""
+    chunks = response.iter_content(chunk_size=chunk_size)
+    yield from iter_tables(chunks, encoding=response_encoding(response), backend=backend)
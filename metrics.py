@@ -0,0 +1,202 @@
+"""
+Stage timings and counters
+Off by default. Set GDOC_METRICS_FILE to a path to enable it; at exit the
+run's per-stage wall time, counters (bytes fetched, tables, rows, cells)
+and peak memory are written there. GDOC_METRICS_FORMAT picks the format:
+'jsonl' (default - one JSON object appended per run) or 'prometheus' (the
+text exposition format, rewritten each run for a textfile collector). A
+path ending in .prom implies 'prometheus'.
+
+Stages nest: time spent in an inner stage is reported under the inner
+stage only, so the stage times of a run add up to its instrumented time.
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+FORMATS = ('jsonl', 'prometheus')
+
+# Prefix of every exported Prometheus metric
+PROMETHEUS_PREFIX = 'gdoc'
+
+
+class _NullStage:
+    """Context manager used when metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'start', 'children')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.children = 0.0
+        self.metrics._stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = self.metrics._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        self.metrics._add_stage(self.name, elapsed - self.children)
+        return False
+
+
+class Metrics:
+    """Per-stage wall time and named counters for one run"""
+
+    def __init__(self, file_name=None, fmt=None):
+        self.file_name = file_name
+        if fmt is None:
+            fmt = 'prometheus' if file_name and file_name.endswith('.prom') else 'jsonl'
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown metrics format: {fmt}")
+        self.format = fmt
+        self.enabled = bool(file_name)
+        self.started_at = time.time()
+        self.stage_seconds = {}
+        self.stage_calls = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _add_stage(self, name, seconds):
+        with self._lock:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+
+    def stage(self, name):
+        """Context manager timing one stage; a no-op when disabled"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def add(self, name, value=1):
+        """Add value to a counter; does nothing when disabled"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_tables(self, tables):
+        """Count the tables, rows and cells of a list of row-list tables"""
+        if not self.enabled:
+            return
+        self.add('tables', len(tables))
+        self.add('rows', sum(len(table) for table in tables))
+        self.add('cells', sum(len(row) for table in tables for row in table))
+
+    def snapshot(self):
+        """The run so far as a JSON-serialisable dict"""
+        with self._lock:
+            return {
+                'timestamp': self.started_at,
+                'argv': sys.argv,
+                'stages': {
+                    name: {'seconds': seconds, 'calls': self.stage_calls[name]}
+                    for name, seconds in self.stage_seconds.items()
+                },
+                'counters': dict(self.counters),
+                'peak_memory_bytes': peak_memory_bytes(),
+            }
+
+    def write(self):
+        if self.format == 'prometheus':
+            self._write_prometheus()
+        else:
+            with open(self.file_name, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(self.snapshot()) + '\n')
+
+    def _write_prometheus(self):
+        snapshot = self.snapshot()
+        prefix = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {prefix}_stage_seconds Wall time spent in each stage (inner stages excluded)",
+            f"# TYPE {prefix}_stage_seconds gauge",
+        ]
+        for name, stage in snapshot['stages'].items():
+            lines.append(f'{prefix}_stage_seconds{{stage="{name}"}} {stage["seconds"]:.6f}')
+        lines += [
+            f"# HELP {prefix}_stage_calls Times each stage was entered",
+            f"# TYPE {prefix}_stage_calls gauge",
+        ]
+        for name, stage in snapshot['stages'].items():
+            lines.append(f'{prefix}_stage_calls{{stage="{name}"}} {stage["calls"]}')
+        for name, value in snapshot['counters'].items():
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+        if snapshot['peak_memory_bytes'] is not None:
+            lines.append(f"# TYPE {prefix}_peak_memory_bytes gauge")
+            lines.append(f"{prefix}_peak_memory_bytes {snapshot['peak_memory_bytes']}")
+        lines.append(f"# TYPE {prefix}_run_timestamp_seconds gauge")
+        lines.append(f"{prefix}_run_timestamp_seconds {snapshot['timestamp']:.3f}")
+
+        # a collector must never see a half-written file
+        tmp_path = self.file_name + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.file_name)
+
+    def close(self):
+        """Write the run out once, if anything was recorded"""
+        if self.enabled and (self.stage_seconds or self.counters):
+            self.write()
+        self.enabled = False
+
+
+def peak_memory_bytes():
+    """Peak resident set size of this process, or None where unavailable"""
+    try:
+        import resource
+    except ImportError:  # not on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+_metrics = None
+
+
+def configure_metrics(file_name, fmt=None):
+    """Replace the process-wide Metrics (e.g. from command line options)"""
+    global _metrics
+    if _metrics is not None:
+        _metrics.close()
+    _metrics = Metrics(file_name, fmt)
+    atexit.register(_metrics.close)
+    return _metrics
+
+
+def get_metrics():
+    """Return the process-wide Metrics, configured from the environment"""
+    if _metrics is None:
+        configure_metrics(
+            os.environ.get('GDOC_METRICS_FILE'),
+            os.environ.get('GDOC_METRICS_FORMAT'),
+        )
+    return _metrics
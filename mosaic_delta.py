@@ -0,0 +1,184 @@
+"""
+Incremental mosaic re-decode
+Keeps the previous run's coordinate rows (with a hash of each row) per
+document ID, works out which rows were inserted, removed or changed, and
+re-renders only the mosaic rows those touch. The delta is reported so
+downstream consumers can patch instead of reloading.
+
+State lives next to the table cache (GDOC_CACHE_DIR/mosaic_state).
+"""
+
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+from mosaic_grid import BLANK, render_row_cells
+from table_cache import DEFAULT_CACHE_DIR
+
+STATE_DIR = 'mosaic_state'
+
+# inserted / changed: [(x, y, glyph)]; removed: [(x, y)];
+# lines: {y: re-rendered line} for every display row that changed
+MosaicDelta = namedtuple('MosaicDelta', ['table', 'inserted', 'removed', 'changed', 'lines'])
+
+
+def row_hash(row):
+    """Short stable hash of a scraped row's cells"""
+    return hashlib.blake2b('\x1f'.join(row).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def delta_to_json(delta):
+    """One JSON object describing a MosaicDelta"""
+    return json.dumps({
+        'table': delta.table,
+        'inserted': delta.inserted,
+        'removed': delta.removed,
+        'changed': delta.changed,
+        'lines': {str(y): line for y, line in sorted(delta.lines.items())},
+    }, ensure_ascii=False)
+
+
+class MosaicState:
+    """The decoded rows and rendered lines of one mosaic table"""
+
+    def __init__(self, sep=BLANK):
+        self.sep = sep
+        self.hashes = {}   # (x, y) -> row hash
+        self.cells = {}    # y -> {x: glyph}
+        self.lines = {}    # y -> rendered line; blank rows are left out
+        self.origin = (0, 0)
+        self.max_y = -1
+
+    def apply(self, rows, table=0, skip_header=True):
+        """Diff the new rows against the stored ones and update in place"""
+        new_hashes = {}
+        new_glyphs = {}
+        rows = iter(rows)
+        if skip_header:
+            next(rows, None)
+        min_x = min_y = 0
+        max_y = -1
+        for row in rows:
+            x, y = int(row[0]), int(row[2])
+            new_hashes[(x, y)] = row_hash(row)
+            new_glyphs[(x, y)] = row[1]
+            min_x = min(min_x, x)
+            min_y = min(min_y, y)
+            max_y = max(max_y, y)
+
+        inserted = []
+        changed = []
+        for key, digest in new_hashes.items():
+            old = self.hashes.get(key)
+            if old is None:
+                inserted.append((key[0], key[1], new_glyphs[key]))
+            elif old != digest:
+                changed.append((key[0], key[1], new_glyphs[key]))
+        removed = [key for key in self.hashes if key not in new_hashes]
+
+        # Apply to the per-row cells
+        touched = set()
+        for x, y in removed:
+            row_cells = self.cells.get(y)
+            if row_cells is not None:
+                row_cells.pop(x, None)
+                if not row_cells:
+                    del self.cells[y]
+            touched.add(y)
+        for x, y, glyph in inserted + changed:
+            self.cells.setdefault(y, {})[x] = glyph
+            touched.add(y)
+        self.hashes = new_hashes
+
+        # A new origin shifts every line; otherwise only touched rows move
+        origin = (min_x, min_y)
+        if origin != self.origin:
+            self.origin = origin
+            touched = set(self.cells) | set(self.lines)
+        self.max_y = max_y
+
+        lines = {}
+        for y in touched:
+            line = self._render(y)
+            if line:
+                self.lines[y] = line
+            else:
+                self.lines.pop(y, None)
+            lines[y] = line
+
+        return MosaicDelta(table, inserted, removed, changed, lines)
+
+    def _render(self, y):
+        row_cells = self.cells.get(y)
+        if not row_cells:
+            return ''
+        return render_row_cells(((x, row_cells[x]) for x in sorted(row_cells)), self.origin[0], self.sep)
+
+    def iter_rows(self):
+        """Yield the full rendered mosaic from the stored lines"""
+        for y in range(self.origin[1], self.max_y + 1):
+            yield self.lines.get(y, '')
+
+    def to_dict(self):
+        return {
+            'sep': self.sep,
+            'origin': list(self.origin),
+            'max_y': self.max_y,
+            'rows': [[x, y, digest, self.cells[y][x]] for (x, y), digest in self.hashes.items()],
+            'lines': {str(y): line for y, line in self.lines.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['sep'])
+        state.origin = tuple(data['origin'])
+        state.max_y = data['max_y']
+        for x, y, digest, glyph in data['rows']:
+            state.hashes[(x, y)] = digest
+            state.cells.setdefault(y, {})[x] = glyph
+        state.lines = {int(y): line for y, line in data['lines'].items()}
+        return state
+
+
+class DeltaStore:
+    """Per-document MosaicState lists kept on disk between runs"""
+
+    def __init__(self, state_dir=None):
+        if state_dir is None:
+            state_dir = os.path.join(os.environ.get('GDOC_CACHE_DIR', DEFAULT_CACHE_DIR), STATE_DIR)
+        self.state_dir = state_dir
+
+    def _path(self, doc_id):
+        return os.path.join(self.state_dir, f"{doc_id}.json")
+
+    def load(self, doc_id):
+        try:
+            with open(self._path(doc_id), 'r', encoding='utf-8') as f:
+                return [MosaicState.from_dict(data) for data in json.load(f)]
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def save(self, doc_id, states):
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = self._path(doc_id) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([state.to_dict() for state in states], f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(doc_id))
+
+    def update(self, doc_id, tables):
+        """
+        Apply a fresh scrape of a document to its stored state and return one
+        MosaicDelta per table. Tables that disappeared report every row removed.
+        """
+        states = self.load(doc_id)
+        deltas = []
+        for i, table in enumerate(tables):
+            if i == len(states):
+                states.append(MosaicState())
+            deltas.append(states[i].apply(table, table=i))
+        for i in range(len(tables), len(states)):
+            deltas.append(states[i].apply([], table=i, skip_header=False))
+        del states[len(tables):]
+        self.save(doc_id, states)
+        return deltas
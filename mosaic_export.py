@@ -0,0 +1,169 @@
+"""
+Binary mosaic export
+Writes a decoded (x, y, glyph) set as a compact columnar file and maps it
+back without parsing or copying.
+
+Layout (little-endian):
+    header   32 bytes: magic b'GDMX', version u16, reserved u16,
+             cell count u64, glyph count u32, glyph blob size u32, 8 reserved
+    x        int32  [cell count]
+    y        int32  [cell count]
+    glyph    uint32 [cell count]   index into the glyph table
+    offsets  uint32 [glyph count + 1] byte offsets into the glyph blob
+    blob     UTF-8 glyph text
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; the reader falls back to memoryviews
+    numpy = None
+
+from mosaic_grid import MosaicGrid
+
+MAGIC = b'GDMX'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQII8x')
+
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+
+def _cells_of(mosaic):
+    if isinstance(mosaic, MosaicGrid):
+        return ((mosaic.xs[i], mosaic.ys[i], mosaic.glyph_at(i)) for i in range(len(mosaic)))
+    if isinstance(mosaic, dict):
+        return ((x, y, glyph) for (x, y), glyph in mosaic.items())
+    return mosaic
+
+
+def _little_endian(column):
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column
+
+
+def write_mosaic(path, mosaic):
+    """
+    Write a MosaicGrid, a {(x, y): glyph} dict or (x, y, glyph) triples to
+    path. Returns the number of cells written.
+    """
+    xs = array('i')
+    ys = array('i')
+    glyph_ids = array('I')
+    glyph_index = {}
+    for x, y, glyph in _cells_of(mosaic):
+        if not (INT32_MIN <= x <= INT32_MAX and INT32_MIN <= y <= INT32_MAX):
+            raise ValueError(f"Coordinate ({x}, {y}) does not fit in int32")
+        xs.append(x)
+        ys.append(y)
+        if glyph not in glyph_index:
+            glyph_index[glyph] = len(glyph_index)
+        glyph_ids.append(glyph_index[glyph])
+
+    encoded = [glyph.encode('utf-8') for glyph in glyph_index]
+    offsets = array('I', [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    blob = b''.join(encoded)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(xs), len(encoded), len(blob)))
+        for column in (xs, ys, glyph_ids, offsets):
+            f.write(_little_endian(column).tobytes())
+        f.write(blob)
+    os.replace(tmp_path, path)
+    return len(xs)
+
+
+class MosaicFile:
+    """
+    Memory-mapped reader for files written by write_mosaic. The x, y and
+    glyph columns are views straight onto the map: NumPy arrays when NumPy is
+    installed, memoryviews otherwise.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER.size:
+            self._file.close()
+            raise ValueError(f"{path} is too short to be a mosaic file")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, count, glyph_count, blob_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} mosaic file")
+        self.count = count
+
+        offset = HEADER.size
+        self.xs = self._column('<i4', 'i', offset, count)
+        offset += 4 * count
+        self.ys = self._column('<i4', 'i', offset, count)
+        offset += 4 * count
+        self.glyph_ids = self._column('<u4', 'I', offset, count)
+        offset += 4 * count
+        glyph_offsets = struct.unpack_from(f'<{glyph_count + 1}I', self._map, offset)
+        offset += 4 * (glyph_count + 1)
+        blob = self._map[offset:offset + blob_size]
+        self.glyphs = [
+            blob[glyph_offsets[i]:glyph_offsets[i + 1]].decode('utf-8')
+            for i in range(glyph_count)
+        ]
+
+    def _column(self, dtype, typecode, offset, count):
+        if numpy is not None:
+            return numpy.frombuffer(self._map, dtype=dtype, count=count, offset=offset)
+        view = memoryview(self._map)[offset:offset + 4 * count]
+        if sys.byteorder != 'little':
+            # No zero-copy view possible; swap into a private copy
+            column = array(typecode, view.tobytes())
+            column.byteswap()
+            return column
+        return view.cast(typecode)
+
+    def __len__(self):
+        return self.count
+
+    def iter_cells(self):
+        """Yield (x, y, glyph) for every stored cell"""
+        glyphs = self.glyphs
+        for x, y, g in zip(self.xs, self.ys, self.glyph_ids):
+            yield int(x), int(y), glyphs[g]
+
+    def to_dict(self):
+        return {(x, y): glyph for x, y, glyph in self.iter_cells()}
+
+    def to_grid(self):
+        return MosaicGrid.from_cells(self.iter_cells())
+
+    def close(self):
+        # Views onto the map must be dropped before it can be closed
+        self.xs = self.ys = self.glyph_ids = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_path_for(path, table):
+    """Per-table export path: '{table}' in path is replaced, else a suffix is added after the first"""
+    if '{table}' in path:
+        return path.format(table=table)
+    if table == 0:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{table}{ext}"
@@ -0,0 +1,332 @@
+"""
+Sparse mosaic grid
+Holds decoded (x, y, glyph) cells in compact sorted arrays so rendering costs
+scale with the populated cells and rows rather than the bounding box area.
+"""
+
+from array import array
+from bisect import bisect_left
+
+# NumPy is optional and only imported once a dense raster is worth building;
+# the sparse path needs only the stdlib
+_numpy = None
+
+# Codepoints at or above this value index into the grid's glyph table instead
+# of naming a character (used for glyphs that are not exactly one character)
+GLYPH_TABLE_BASE = 0x110000
+
+# Use a NumPy raster once at least this fraction of the bounding box is filled
+DENSE_FILL_RATIO = 0.25
+
+BLANK = ' '
+
+
+def _load_numpy():
+    """Return the numpy module, or None when it is not installed"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def render_row_cells(cells, x0=0, sep=BLANK):
+    """Render one row from (x, glyph) pairs sorted by x, with x0 as the left edge"""
+    # Each skipped column renders as a blank plus its separator
+    column = BLANK + sep
+    parts = []
+    prev_x = None
+    for x, glyph in cells:
+        if prev_x is None:
+            parts.append(column * (x - x0))
+        else:
+            parts.append(sep + column * (x - prev_x - 1))
+        parts.append(glyph)
+        prev_x = x
+    return ''.join(parts)
+
+
+class CoordinateIndex:
+    """Running min / max of both axes, kept up to date as cells are added"""
+
+    __slots__ = ('min_x', 'max_x', 'min_y', 'max_y', 'count')
+
+    def __init__(self):
+        self.min_x = self.min_y = None
+        self.max_x = self.max_y = None
+        self.count = 0
+
+    @classmethod
+    def from_keys(cls, keys):
+        """Index an iterable of (x, y) pairs in one pass"""
+        index = cls()
+        for x, y in keys:
+            index.add(x, y)
+        return index
+
+    def add(self, x, y):
+        if self.count == 0:
+            self.min_x = self.max_x = x
+            self.min_y = self.max_y = y
+        else:
+            if x < self.min_x:
+                self.min_x = x
+            elif x > self.max_x:
+                self.max_x = x
+            if y < self.min_y:
+                self.min_y = y
+            elif y > self.max_y:
+                self.max_y = y
+        self.count += 1
+
+    def __bool__(self):
+        return self.count > 0
+
+    def default_origin(self):
+        """(0, 0), moved up / left as needed so negative coordinates are shown"""
+        if not self:
+            return 0, 0
+        return min(0, self.min_x), min(0, self.min_y)
+
+    def __repr__(self):
+        return f"CoordinateIndex(x={self.min_x}..{self.max_x}, y={self.min_y}..{self.max_y}, cells={self.count})"
+
+
+class MosaicGrid:
+    """Sorted-coordinate store for a decoded mosaic"""
+
+    def __init__(self, xs, ys, codes, glyphs=None, bounds=None):
+        # Parallel arrays sorted by (y, x) with duplicate coordinates removed
+        self.xs = xs
+        self.ys = ys
+        self.codes = codes
+        self.glyphs = glyphs or []
+        self.bounds = bounds if bounds is not None else CoordinateIndex.from_keys(zip(xs, ys))
+
+    @classmethod
+    def from_cells(cls, cells):
+        """Build a grid from (x, y, glyph) triples; later duplicates win"""
+        xs = array('q')
+        ys = array('q')
+        raw = []
+        # Track the bounds as cells arrive instead of scanning afterwards
+        bounds = CoordinateIndex()
+        for x, y, glyph in cells:
+            xs.append(x)
+            ys.append(y)
+            raw.append(glyph)
+            bounds.add(x, y)
+
+        # Stable sort keeps insertion order among duplicate coordinates
+        order = sorted(range(len(raw)), key=lambda i: (ys[i], xs[i]))
+
+        grid = cls(array('q'), array('q'), array('I'), bounds=bounds)
+        glyph_index = {}
+        for pos, i in enumerate(order):
+            nxt = order[pos + 1] if pos + 1 < len(order) else None
+            if nxt is not None and xs[nxt] == xs[i] and ys[nxt] == ys[i]:
+                continue
+            grid.xs.append(xs[i])
+            grid.ys.append(ys[i])
+            grid.codes.append(grid._encode(raw[i], glyph_index))
+        # Duplicates were dropped; the bounds are unchanged by that
+        bounds.count = len(grid.codes)
+        return grid
+
+    @classmethod
+    def from_dict(cls, cells):
+        """Build a grid from a {(x, y): glyph} mapping"""
+        return cls.from_cells((x, y, glyph) for (x, y), glyph in cells.items())
+
+    def _encode(self, glyph, glyph_index):
+        if len(glyph) == 1:
+            return ord(glyph)
+        if glyph not in glyph_index:
+            glyph_index[glyph] = GLYPH_TABLE_BASE + len(self.glyphs)
+            self.glyphs.append(glyph)
+        return glyph_index[glyph]
+
+    def glyph_at(self, index):
+        """Return the glyph stored at a position in the sorted arrays"""
+        code = self.codes[index]
+        if code >= GLYPH_TABLE_BASE:
+            return self.glyphs[code - GLYPH_TABLE_BASE]
+        return chr(code)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def max_x(self):
+        return self.bounds.max_x if self.bounds else -1
+
+    def max_y(self):
+        return self.bounds.max_y if self.bounds else -1
+
+    def is_dense(self, origin=(0, 0), sep=BLANK):
+        """True when a NumPy raster is available and worth building"""
+        if not self.codes or self.glyphs or len(sep) > 1:
+            return False
+        ox, oy = origin
+        area = (self.max_x() - ox + 1) * (self.max_y() - oy + 1)
+        # checked last so sparse mosaics never import NumPy
+        return len(self.codes) >= area * DENSE_FILL_RATIO and _load_numpy() is not None
+
+    def iter_rows(self, origin=None, sep=BLANK):
+        """
+        Yield each display row from the origin down to max_y, cells joined by
+        sep. The origin defaults to (0, 0), or further up / left when there
+        are negative coordinates; cells above or left of it are not shown.
+        """
+        if origin is None:
+            origin = self.bounds.default_origin()
+        if self.is_dense(origin, sep):
+            yield from self._iter_raster_rows(origin, sep)
+        else:
+            yield from self._iter_sparse_rows(origin, sep)
+
+    def _iter_sparse_rows(self, origin, sep):
+        ox, oy = origin
+        n = len(self.codes)
+        # Cells above the origin are outside the rendered area
+        i = bisect_left(self.ys, oy)
+        for y in range(oy, self.max_y() + 1):
+            if i >= n or self.ys[i] != y:
+                yield ''
+                continue
+            start, end = self._row_range(y, i)
+            i = end
+            # Cells left of the origin are outside it too; xs are sorted within the row
+            yield self._render_row(bisect_left(self.xs, ox, start, end), end, ox, sep)
+
+    def _row_range(self, y, lo=0):
+        """Positions [start, end) of row y in the sorted arrays"""
+        start = bisect_left(self.ys, y, lo)
+        end = bisect_left(self.ys, y + 1, start)
+        return start, end
+
+    def _render_row(self, start, end, x0, sep):
+        """Render positions [start, end) of one row with x0 as the left edge"""
+        return render_row_cells(((self.xs[i], self.glyph_at(i)) for i in range(start, end)), x0, sep)
+
+    def iter_window(self, x0, y0, x1, y1, sep=BLANK):
+        """
+        Yield the rows of the window x0 <= x < x1, y0 <= y < y1. Only the
+        cells inside the window are touched: rows and columns are located by
+        binary search on the (y, x) sorted arrays.
+        """
+        lo = bisect_left(self.ys, y0)
+        for y in range(y0, y1):
+            start, end = self._row_range(y, lo)
+            lo = end
+            if start == end:
+                yield ''
+                continue
+            # Within a row the xs are sorted too
+            first = bisect_left(self.xs, x0, start, end)
+            last = bisect_left(self.xs, x1, first, end)
+            yield self._render_row(first, last, x0, sep)
+
+    def iter_tiles(self, tile_width, tile_height, sep=BLANK):
+        """
+        Yield (x0, y0, rows) for every tile_width x tile_height tile holding
+        at least one cell, top to bottom then left to right. Tiles are aligned
+        to multiples of the tile size; each cell is visited once. Raises
+        ValueError (when called, not on first use) for a size below 1.
+        """
+        if tile_width < 1 or tile_height < 1:
+            raise ValueError(f"Tile size must be at least 1x1, got {tile_width}x{tile_height}")
+        return self._iter_tiles(tile_width, tile_height, sep)
+
+    def _iter_tiles(self, tile_width, tile_height, sep):
+        n = len(self.codes)
+        i = 0
+        while i < n:
+            # One band of tile rows is a contiguous run of the sorted arrays
+            band_y0 = self.ys[i] // tile_height * tile_height
+            band_end = bisect_left(self.ys, band_y0 + tile_height, i)
+
+            # Bucket the band's positions by tile column; order stays (y, x)
+            buckets = {}
+            for pos in range(i, band_end):
+                buckets.setdefault(self.xs[pos] // tile_width, []).append(pos)
+
+            for tile_x in sorted(buckets):
+                positions = buckets[tile_x]
+                x0 = tile_x * tile_width
+                rows = []
+                k = 0
+                for y in range(band_y0, band_y0 + tile_height):
+                    start = k
+                    while k < len(positions) and self.ys[positions[k]] == y:
+                        k += 1
+                    rows.append(self._render_positions(positions[start:k], x0, sep))
+                yield x0, band_y0, rows
+            i = band_end
+
+    def _render_positions(self, positions, x0, sep):
+        if not positions:
+            return ''
+        # Positions of one row in one tile are consecutive in the arrays
+        return self._render_row(positions[0], positions[-1] + 1, x0, sep)
+
+    def _iter_raster_rows(self, origin, sep):
+        numpy = _load_numpy()
+        ox, oy = origin
+        step = 1 + len(sep)
+        width = self.max_x() - ox + 1
+        raster = numpy.full((self.max_y() - oy + 1, step * width - len(sep)), ord(BLANK), dtype=numpy.uint32)
+        if sep and sep != BLANK:
+            raster[:, 1::step] = ord(sep)
+        ys = numpy.frombuffer(self.ys, dtype=numpy.int64) - oy
+        xs = numpy.frombuffer(self.xs, dtype=numpy.int64) - ox
+        inside = (ys >= 0) & (xs >= 0)
+        codes = numpy.frombuffer(self.codes, dtype=numpy.uint32)
+        raster[ys[inside], step * xs[inside]] = codes[inside]
+        for row in raster:
+            # Trailing blanks are dropped to match the sparse renderer
+            yield row.astype('<u4').tobytes().decode('utf-32-le').rstrip(BLANK)
+
+
+def decode_mosaic_rows(rows, x_col=0, glyph_col=1, y_col=2, skip_header=True):
+    """
+    Yields (x, y, glyph) for each row of a scraped mosaic table, consuming
+    the rows once as they arrive. The header row is skipped without copying.
+    """
+    rows = iter(rows)
+    if skip_header:
+        next(rows, None)
+    for row in rows:
+        yield int(row[x_col]), int(row[y_col]), row[glyph_col]
+
+
+def parse_coordinate_columns(rows, x_col=0, y_col=2):
+    """
+    Reads the x and y columns of a whole table into integer arrays.
+    Returns (xs, ys, row_index, bad_rows) where row_index holds the source
+    row of each parsed coordinate and bad_rows lists (index, reason) pairs
+    for rows that could not be parsed (e.g. the header row).
+    """
+    xs = array('q')
+    ys = array('q')
+    row_index = array('q')
+    bad_rows = []
+
+    min_cols = max(x_col, y_col) + 1
+    for i, row in enumerate(rows):
+        if len(row) < min_cols:
+            bad_rows.append((i, f"expected at least {min_cols} columns, got {len(row)}"))
+            continue
+        try:
+            x = int(row[x_col])
+            y = int(row[y_col])
+        except ValueError:
+            bad_rows.append((i, f"non-integer coordinate in {row[x_col]!r}, {row[y_col]!r}"))
+            continue
+        xs.append(x)
+        ys.append(y)
+        row_index.append(i)
+
+    return xs, ys, row_index, bad_rows
@@ -0,0 +1,127 @@
+"""
+Buffered mosaic output
+Writes rendered rows in large batches (one write per batch instead of one
+print per cell or row), to stdout, a file, or a memory-mapped file.
+"""
+
+import mmap
+import sys
+
+# Bytes collected before each write
+DEFAULT_BATCH_BYTES = 1 << 20
+
+
+def _binary_stdout():
+    # Anything already printed must come out before our bytes do
+    sys.stdout.flush()
+    return getattr(sys.stdout, 'buffer', None)
+
+
+def render_rows(rows, out=None, end='\n', encoding='utf-8', batch_bytes=DEFAULT_BATCH_BYTES):
+    """
+    Write each rendered row followed by end to a binary stream (default:
+    stdout). Returns the number of bytes written.
+    """
+    text_out = None
+    if out is None:
+        out = _binary_stdout()
+        if out is None:
+            # e.g. stdout replaced by a StringIO - fall back to text writes
+            text_out = sys.stdout
+
+    written = 0
+    batch = []
+    size = 0
+    for row in rows:
+        line = row + end
+        if text_out is None:
+            line = line.encode(encoding)
+        batch.append(line)
+        size += len(line)
+        if size >= batch_bytes:
+            written += _write_batch(out, text_out, batch)
+            batch.clear()
+            size = 0
+    if batch:
+        written += _write_batch(out, text_out, batch)
+
+    if text_out is None:
+        out.flush()
+    return written
+
+
+def _write_batch(out, text_out, batch):
+    if text_out is not None:
+        data = ''.join(batch)
+        text_out.write(data)
+        return len(data.encode('utf-8'))
+    data = b''.join(batch)
+    out.write(data)
+    return len(data)
+
+
+def render_to_file(rows, path, end='\n', encoding='utf-8', use_mmap=False, batch_bytes=DEFAULT_BATCH_BYTES):
+    """
+    Write rendered rows straight to a file. With use_mmap the rows are copied
+    into the file through a memory map, one window of about batch_bytes at a
+    time: the file grows a window ahead of the rows and is cut to size at
+    the end, so neither the rows nor the whole map are held at once.
+    Returns the bytes written.
+    """
+    if not use_mmap:
+        with open(path, 'wb', buffering=batch_bytes) as f:
+            return render_rows(rows, f, end, encoding)
+
+    # map offsets must be multiples of the allocation granularity
+    granularity = mmap.ALLOCATIONGRANULARITY
+    window = max(1, batch_bytes // granularity) * granularity
+    total = 0
+    with open(path, 'w+b') as f:
+        mapped = None
+        start = 0
+        try:
+            for row in rows:
+                line = (row + end).encode(encoding)
+                pos = 0
+                while pos < len(line):
+                    if mapped is None or total - start >= window:
+                        if mapped is not None:
+                            mapped.close()
+                            start += window
+                        f.truncate(start + window)
+                        mapped = mmap.mmap(f.fileno(), window, offset=start)
+                    count = min(len(line) - pos, start + window - total)
+                    offset = total - start
+                    mapped[offset:offset + count] = line[pos:pos + count]
+                    pos += count
+                    total += count
+        finally:
+            if mapped is not None:
+                mapped.flush()
+                mapped.close()
+        f.truncate(total)
+    return total
+
+
+def tile_lines(tiles):
+    """Rows of (x0, y0, rows) tiles, each tile under a header naming its origin"""
+    for x0, y0, rows in tiles:
+        yield f"--- tile x={x0} y={y0} ---"
+        yield from rows
+
+
+def render_tiles(tiles, out=None, end='\n'):
+    """Write (x0, y0, rows) tiles, each under a header naming its origin"""
+    return render_rows(tile_lines(tiles), out, end)
+
+
+def write_rendered(data, out=None):
+    """Write output already rendered to bytes (e.g. by a worker process)"""
+    if out is None:
+        out = _binary_stdout()
+        if out is None:
+            sys.stdout.write(data.decode('utf-8'))
+            return len(data)
+    out.write(data)
+    out.flush()
+    return len(data)
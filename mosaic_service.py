@@ -0,0 +1,341 @@
+"""
+Mosaic HTTP service
+A long-running server (stdlib http.server) so other services can ask for a
+document's tables without paying interpreter start-up, imports and a full
+fetch and parse per request. Decoded documents are kept in a size-bounded
+LRU with a TTL, and concurrent requests for the same document share one
+in-flight fetch.
+
+Endpoints (document_id as in the doc's URL - letters, digits, '_' and '-',
+anything else is a 400; ?source=api reads it through the Docs API instead
+of the published page):
+    GET /docs/<document_id>/tables   {"document_id": ..., "tables": [[[cell, ...], ...], ...]}
+    GET /docs/<document_id>/cells    {"document_id": ..., "tables": [[[x, y, glyph], ...], ...]}
+    GET /docs/<document_id>/mosaic   the rendered mosaics as text/plain, one blank line between tables
+    GET /stats                       cache and fetch counters
+    GET /healthz
+
+Run with: python gdoc_cli.py serve [--port N] [--max-entries N] [--max-bytes N] [--ttl S]
+"""
+
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from mosaic_grid import MosaicGrid
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL = 300
+
+SOURCES = ('published', 'api')
+
+# Google document IDs, including the '2PACX-...' IDs of published links
+DOCUMENT_ID = re.compile(r'[A-Za-z0-9_-]+')
+
+
+class LRUCache:
+    """Thread-safe LRU bounded by entry count and total size, with a TTL"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        # key -> (value, size, stored_at); most recently used last
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the live value for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._clock() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store value, evicting least recently used entries to stay in bounds"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                # would evict everything and still not fit
+                return
+            self._entries[key] = (value, size, self._clock())
+            self._bytes += size
+            self._evict()
+
+    def resize(self, key, value, size):
+        """Record a new size for a kept value (e.g. once it has grown), evicting to stay in bounds"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not value:
+                return
+            self._entries[key] = (value, size, entry[2])
+            self._bytes += size - entry[1]
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries), 'bytes': self._bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            }
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers wait for its result"""
+
+    class _Call:
+        __slots__ = ('done', 'result', 'error')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = func()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class Document:
+    """
+    A fetched document's tables; the decoded views are built on first use.
+    size is an estimate of the memory held, views included.
+    """
+
+    def __init__(self, document_id, tables):
+        self.document_id = document_id
+        self.tables = [[list(row) for row in table] for table in tables]
+        self.size = sum(len(cell.encode('utf-8')) + 8 for table in self.tables for row in table for cell in row)
+        self._lock = threading.Lock()
+        self._cells = None
+        self._mosaic = None
+
+    def cells(self):
+        """Per table, the decoded (x, y, glyph) triples sorted by (y, x)"""
+        with self._lock:
+            if self._cells is None:
+                from decode_doc import decode_table
+                self._cells = []
+                for table in self.tables:
+                    mosaic, _ = decode_table(table)
+                    self._cells.append(sorted(
+                        ([x, y, glyph] for (x, y), glyph in mosaic.items()),
+                        key=lambda cell: (cell[1], cell[0]),
+                    ))
+                # a list of two ints and a glyph per cell
+                self.size += sum(len(glyph.encode('utf-8')) + 24 for table in self._cells for _, _, glyph in table)
+            return self._cells
+
+    def mosaic(self):
+        """The rendered mosaics, one blank line between tables"""
+        cells = self.cells()
+        with self._lock:
+            if self._mosaic is None:
+                self._mosaic = '\n\n'.join(
+                    '\n'.join(MosaicGrid.from_cells(table_cells).iter_rows())
+                    for table_cells in cells
+                ) + '\n'
+                self.size += len(self._mosaic.encode('utf-8'))
+            return self._mosaic
+
+
+def published_url(document_id):
+    """The published-page URL for a document ID ('2PACX-' IDs come from /d/e/ links)"""
+    if document_id.startswith('2PACX-'):
+        return f"https://docs.google.com/document/d/e/{document_id}/pub"
+    return f"https://docs.google.com/document/d/{document_id}/export?format=html"
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def _published_fetcher():
+    """
+    A DocFetcher that holds no tables itself: the service's LRU is the only
+    in-memory copy, and 304 revalidation goes through the table cache.
+    """
+    global _fetcher
+    # imported here so the server starts without the network / parser stacks
+    from doc_fetch import DocFetcher
+    from table_cache import get_table_cache
+
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = DocFetcher(cache=get_table_cache(), keep_tables=False)
+        return _fetcher
+
+
+def fetch_published(document_id):
+    from gdoc_scrape_0 import parse_tables
+
+    return _published_fetcher().fetch_tables(
+        document_id, published_url(document_id),
+        lambda response: parse_tables(response, 'html.parser'),
+    )
+
+
+# The Docs client (credentials, httplib2 transport) is not thread-safe, so
+# handler threads take turns with it
+_api_lock = threading.Lock()
+
+
+def fetch_api(document_id):
+    from decode_doc import get_documents_tables
+
+    with _api_lock:
+        tables = get_documents_tables([document_id])[document_id]
+    if isinstance(tables, Exception):
+        raise tables
+    return tables
+
+
+class DocumentService:
+    """Documents by (source, ID), from the LRU or one shared fetch"""
+
+    def __init__(self, cache=None, fetchers=None):
+        self.cache = cache or LRUCache()
+        self.fetchers = fetchers or {'published': fetch_published, 'api': fetch_api}
+        self.flights = SingleFlight()
+        self.fetches = 0
+        self._lock = threading.Lock()
+
+    def get(self, document_id, source='published'):
+        key = (source, document_id)
+        document = self.cache.get(key)
+        if document is not None:
+            return document
+
+        def load():
+            # a caller that waited on an earlier flight may find it cached
+            document = self.cache.get(key)
+            if document is None:
+                with self._lock:
+                    self.fetches += 1
+                document = Document(document_id, self.fetchers[source](document_id))
+                self.cache.put(key, document, document.size)
+            return document
+
+        return self.flights.do(key, load)
+
+    def account(self, document, source='published'):
+        """Re-size a kept document after a decoded view has been built"""
+        self.cache.resize((source, document.document_id), document, document.size)
+
+    def stats(self):
+        return dict(self.cache.stats(), fetches=self.fetches, coalesced=self.flights.coalesced)
+
+
+class MosaicRequestHandler(BaseHTTPRequestHandler):
+    # set on the subclass made by make_server
+    service = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        query = parse_qs(url.query)
+
+        if parts == ['healthz']:
+            return self._send(200, 'ok\n', 'text/plain')
+        if parts == ['stats']:
+            return self._send_json(200, self.service.stats())
+        if len(parts) != 3 or parts[0] != 'docs' or parts[2] not in ('tables', 'cells', 'mosaic'):
+            return self._send_json(404, {'error': 'not found'})
+
+        document_id, view = parts[1], parts[2]
+        if not DOCUMENT_ID.fullmatch(document_id):
+            return self._send_json(400, {'error': f"invalid document ID: {document_id}"})
+        source = query.get('source', ['published'])[0]
+        if source not in SOURCES:
+            return self._send_json(400, {'error': f"unknown source: {source}"})
+
+        try:
+            document = self.service.get(document_id, source)
+        except Exception as e:
+            return self._send_json(502, {'error': f"could not fetch document: {e}"})
+
+        if view == 'mosaic':
+            text = document.mosaic()
+            self.service.account(document, source)
+            return self._send(200, text, 'text/plain; charset=utf-8')
+        if view == 'cells':
+            body = document.cells()
+            self.service.account(document, source)
+        else:
+            body = document.tables
+        return self._send_json(200, {'document_id': document_id, 'tables': body})
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload, ensure_ascii=False), 'application/json; charset=utf-8')
+
+    def _send(self, status, text, content_type):
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # one line per request, without the default date noise
+        print(f"{self.address_string()} {format % args}")
+
+
+def make_server(host='127.0.0.1', port=8000, service=None):
+    """Build the threaded server; call serve_forever() on it"""
+    handler = type('Handler', (MosaicRequestHandler,), {'service': service or DocumentService()})
+    return ThreadingHTTPServer((host, port), handler)
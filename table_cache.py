@@ -0,0 +1,343 @@
+"""
+On-disk parsed-table cache
+Stores the tables extracted from a document in a compact binary file keyed
+by document ID and a hash of the table content, so a warm run can skip both
+the network and HTML / JSON parsing. Entries are evicted least recently used
+first once the cache grows past its size limit.
+
+Each entry is two files: <key>.json holds the content hash, size and
+validators, and <key>-<hash>.tbl the tables. The .tbl file's mtime is the
+entry's last-used time, so a hit rewrites nothing, and processes sharing the
+directory only ever replace whole entries. The cache is an optimisation: if
+the directory cannot be written, a warning is printed once and the tables
+already in hand are used as they are.
+
+Configured from the environment:
+    GDOC_CACHE_DIR        cache directory (default ./.gdoc_cache)
+    GDOC_CACHE_MAX_BYTES  size limit for all entries (default 256 MiB)
+    GDOC_CACHE_MAX_AGE    seconds an entry is served without asking the
+                          server (default 0: every run revalidates)
+
+Entries are keyed by cache_key(doc_id, source): the same document ID read
+from the published page and through the Docs API yields different tables
+and different validators (ETag vs revisionId), so they never share an entry.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+DEFAULT_CACHE_DIR = './.gdoc_cache'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 0
+
+META_SUFFIX = '.json'
+TABLES_SUFFIX = '.tbl'
+
+# Seconds before an unreferenced entry or temporary file counts as abandoned
+ORPHAN_AGE = 60
+
+# Where a document's tables came from
+PUBLISHED = 'published'
+API = 'api'
+
+
+def cache_key(doc_id, source):
+    """Cache key for a document read from source (PUBLISHED or API)"""
+    return f"{source}.{doc_id}"
+
+# File layout: MAGIC, the table count, then a zlib stream of length-prefixed
+# counts and strings
+MAGIC = b'GDTC\x02'
+_COUNT = struct.Struct('<I')
+
+
+class TablePacker:
+    """
+    Packs tables into a cache entry one at a time, keeping only the
+    compressed bytes, so a document can be cached while it streams.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._compressor = zlib.compressobj()
+        self._chunks = []
+
+    def add(self, table):
+        parts = [_COUNT.pack(len(table))]
+        for row in table:
+            parts.append(_COUNT.pack(len(row)))
+            for cell in row:
+                data = cell.encode('utf-8')
+                parts.append(_COUNT.pack(len(data)))
+                parts.append(data)
+        self._chunks.append(self._compressor.compress(b''.join(parts)))
+        self.count += 1
+
+    def finish(self):
+        """The packed entry; the packer cannot be used afterwards"""
+        self._chunks.append(self._compressor.flush())
+        return MAGIC + _COUNT.pack(self.count) + b''.join(self._chunks)
+
+
+def pack_tables(tables):
+    """Encode a list of tables (lists of row lists of str) as bytes"""
+    packer = TablePacker()
+    for table in tables:
+        packer.add(table)
+    return packer.finish()
+
+
+def unpack_tables(blob):
+    """Decode bytes written by pack_tables"""
+    if not blob.startswith(MAGIC):
+        raise ValueError("Not a table cache file")
+    table_count, = _COUNT.unpack_from(blob, len(MAGIC))
+    data = zlib.decompress(blob[len(MAGIC) + _COUNT.size:])
+    view = memoryview(data)
+    offset = 0
+
+    def count():
+        nonlocal offset
+        value, = _COUNT.unpack_from(view, offset)
+        offset += _COUNT.size
+        return value
+
+    tables = []
+    for _ in range(table_count):
+        table = []
+        for _ in range(count()):
+            row = []
+            for _ in range(count()):
+                size = count()
+                row.append(str(view[offset:offset + size], 'utf-8'))
+                offset += size
+            table.append(row)
+        # rows exactly as stored: published tables were padded when they
+        # were built, Docs API rows keep their own width
+        tables.append(table)
+    return tables
+
+
+class TableCache:
+    """
+    Size-bounded LRU cache of parsed tables on disk. Each entry is its own
+    pair of files, so processes sharing the directory never overwrite each
+    other's entries; a write that fails is reported once and skipped.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._warned = False
+
+    def _meta_path(self, doc_id):
+        return os.path.join(self.cache_dir, doc_id + META_SUFFIX)
+
+    def _entry_path(self, doc_id, content_hash):
+        return os.path.join(self.cache_dir, f"{doc_id}-{content_hash}{TABLES_SUFFIX}")
+
+    def _tmp_path(self, path):
+        # unique per writer, so two processes never share a temporary file
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _warn(self, error):
+        if not self._warned:
+            self._warned = True
+            print(f"Warning: could not update the table cache in {self.cache_dir}, "
+                  f"carrying on without it: {error}", file=sys.stderr)
+
+    def _read_meta(self, doc_id):
+        try:
+            with open(self._meta_path(doc_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, doc_id, record):
+        path = self._meta_path(doc_id)
+        tmp_path = self._tmp_path(path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+
+    def entry(self, doc_id):
+        """Return the record for a document (hash, size, validators, fetched_at, used_at)"""
+        record = self._read_meta(doc_id)
+        if record is None:
+            return None
+        try:
+            record['used_at'] = os.stat(self._entry_path(doc_id, record['hash'])).st_mtime
+        except OSError:
+            record['used_at'] = record['fetched_at']
+        return record
+
+    def is_stale(self, doc_id, max_age=None):
+        """True when there is no entry or it was fetched more than max_age seconds ago"""
+        record = self._read_meta(doc_id)
+        if record is None:
+            return True
+        max_age = self.max_age if max_age is None else max_age
+        return time.time() - record['fetched_at'] > max_age
+
+    def load(self, doc_id):
+        """Return the cached tables for a document, or None"""
+        record = self._read_meta(doc_id)
+        if record is None:
+            return None
+        path = self._entry_path(doc_id, record['hash'])
+        try:
+            with open(path, 'rb') as f:
+                tables = unpack_tables(f.read())
+        except (OSError, ValueError, zlib.error, struct.error):
+            # Missing or corrupt entry - forget it and refetch
+            self.forget(doc_id)
+            return None
+        try:
+            # the entry file's mtime is its last-used time
+            os.utime(path)
+        except OSError as e:
+            self._warn(e)
+        return tables
+
+    def load_fresh(self, doc_id, max_age=None):
+        """Return the cached tables only if the entry is not stale"""
+        if self.is_stale(doc_id, max_age):
+            return None
+        return self.load(doc_id)
+
+    def forget(self, doc_id):
+        """Drop a document's entry and its validators"""
+        with self._lock:
+            record = self._read_meta(doc_id)
+            if record is None:
+                return
+            try:
+                os.remove(self._meta_path(doc_id))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self._warn(e)
+                return
+            self._remove_file(doc_id, record['hash'])
+
+    def touch(self, doc_id):
+        """Mark an entry as just fetched (e.g. after a 304 Not Modified)"""
+        with self._lock:
+            record = self._read_meta(doc_id)
+            if record is None:
+                return
+            record['fetched_at'] = time.time()
+            try:
+                self._write_meta(doc_id, record)
+                os.utime(self._entry_path(doc_id, record['hash']))
+            except OSError as e:
+                self._warn(e)
+
+    def store(self, doc_id, tables, etag=None, last_modified=None):
+        """Write the tables for a document and return their content hash (None if not written)"""
+        return self.store_packed(doc_id, pack_tables(tables), etag, last_modified)
+
+    def store_packed(self, doc_id, blob, etag=None, last_modified=None):
+        """store() for tables already packed, e.g. by a TablePacker"""
+        content_hash = hashlib.sha256(blob).hexdigest()[:16]
+
+        with self._lock:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                previous = self._read_meta(doc_id)
+                path = self._entry_path(doc_id, content_hash)
+                if previous is None or previous['hash'] != content_hash or not os.path.exists(path):
+                    tmp_path = self._tmp_path(path)
+                    with open(tmp_path, 'wb') as f:
+                        f.write(blob)
+                    os.replace(tmp_path, path)
+                else:
+                    os.utime(path)
+
+                self._write_meta(doc_id, {
+                    'hash': content_hash,
+                    'size': len(blob),
+                    'etag': etag,
+                    'last_modified': last_modified,
+                    'fetched_at': time.time(),
+                })
+                if previous is not None and previous['hash'] != content_hash:
+                    self._remove_file(doc_id, previous['hash'])
+                self._evict()
+            except OSError as e:
+                self._warn(e)
+                return None
+        return content_hash
+
+    def _remove_file(self, doc_id, content_hash):
+        try:
+            os.remove(self._entry_path(doc_id, content_hash))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """
+        Remove least recently used entries until the directory fits in
+        max_bytes. Entry files no entry points at (left by a process that
+        died mid-write or lost a race to store the same document) are
+        removed once they are ORPHAN_AGE seconds old.
+        """
+        now = time.time()
+        live = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            files = [(f.name, f.stat()) for f in it if f.is_file()]
+        for name, stat in files:
+            if name.endswith(TABLES_SUFFIX):
+                doc_id, _, content_hash = name[:-len(TABLES_SUFFIX)].rpartition('-')
+                record = self._read_meta(doc_id)
+                if record is not None and record['hash'] == content_hash:
+                    live.append((stat.st_mtime, doc_id, content_hash))
+                    total += stat.st_size
+                    continue
+            elif not name.endswith('.tmp'):
+                continue
+            if now - stat.st_mtime > ORPHAN_AGE:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+            else:
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+        # Least recently used first
+        sizes = {name: stat.st_size for name, stat in files}
+        for _, doc_id, content_hash in sorted(live):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._meta_path(doc_id))
+            except FileNotFoundError:
+                pass
+            self._remove_file(doc_id, content_hash)
+            total -= sizes[f"{doc_id}-{content_hash}{TABLES_SUFFIX}"]
+
+
+_cache = None
+
+
+def get_table_cache():
+    """Return the process-wide TableCache, configured from the environment"""
+    global _cache
+    if _cache is None:
+        _cache = TableCache(
+            os.environ.get('GDOC_CACHE_DIR', DEFAULT_CACHE_DIR),
+            max_bytes=int(os.environ.get('GDOC_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+            max_age=float(os.environ.get('GDOC_CACHE_MAX_AGE', DEFAULT_MAX_AGE)),
+        )
+    return _cache
@@ -0,0 +1,156 @@
+"""
+Streamed table export
+Writes scraped tables as one record per row - the table's index in the
+document, the row's index in the table, and the row's cells - to CSV, JSON
+lines, or an Arrow IPC / Parquet file when pyarrow is installed. Tables are
+consumed one at a time from any iterable (e.g. stream_google_doc_tables or
+decode_doc.iter_structural_tables) and rows are written in bounded batches,
+so only the table being written and one batch are held at once.
+
+Formats:
+    csv       table,row,cell 0,cell 1,... (rows keep their own width)
+    jsonl     {"table": 0, "row": 1, "cells": [...]}
+    arrow     Arrow IPC file; columns table int32, row int64, cells list<string>
+    parquet   Parquet file with the arrow schema, one row group per batch
+"""
+
+import csv
+import json
+import os
+
+from metrics import get_metrics
+
+# Rows collected before each write
+DEFAULT_BATCH_ROWS = 65536
+
+FORMATS = ('csv', 'jsonl', 'arrow', 'parquet')
+
+_EXTENSIONS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.parquet': 'parquet',
+}
+
+
+def format_for_path(path):
+    """Export format implied by a file extension (default csv)"""
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'csv')
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError("Arrow / Parquet export needs pyarrow installed") from None
+    return pyarrow
+
+
+class CsvWriter:
+    def __init__(self, path):
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+
+    def write_batch(self, batch):
+        self._writer.writerows([table, row, *cells] for table, row, cells in batch)
+
+    def close(self):
+        self._file.close()
+
+
+class JsonLinesWriter:
+    def __init__(self, path):
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write_batch(self, batch):
+        self._file.write(''.join(
+            json.dumps({'table': table, 'row': row, 'cells': cells}, ensure_ascii=False) + '\n'
+            for table, row, cells in batch
+        ))
+
+    def close(self):
+        self._file.close()
+
+
+class ArrowWriter:
+    """Arrow IPC file or Parquet file, one record batch / row group per batch"""
+
+    def __init__(self, path, fmt):
+        pa = self._pa = _pyarrow()
+        self.schema = pa.schema([
+            ('table', pa.int32()),
+            ('row', pa.int64()),
+            ('cells', pa.list_(pa.string())),
+        ])
+        if fmt == 'parquet':
+            import pyarrow.parquet
+            self._writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+
+    def write_batch(self, batch):
+        tables, rows, cells = zip(*batch)
+        self._writer.write_batch(self._pa.record_batch(
+            [self._pa.array(tables, self._pa.int32()),
+             self._pa.array(rows, self._pa.int64()),
+             self._pa.array(cells, self._pa.list_(self._pa.string()))],
+            schema=self.schema,
+        ))
+
+    def close(self):
+        self._writer.close()
+
+
+def open_writer(path, fmt=None):
+    """Return a batch writer for path in fmt (default: from the extension)"""
+    fmt = fmt or format_for_path(path)
+    if fmt == 'csv':
+        return CsvWriter(path)
+    if fmt == 'jsonl':
+        return JsonLinesWriter(path)
+    if fmt in ('arrow', 'parquet'):
+        return ArrowWriter(path, fmt)
+    raise ValueError(f"Unknown export format: {fmt}")
+
+
+def iter_table_rows(tables):
+    """Yield (table index, row index, cells) for every row, one table at a time"""
+    for t, table in enumerate(tables):
+        for r, row in enumerate(table):
+            yield t, r, list(row)
+
+
+def export_tables(tables, path, fmt=None, batch_rows=DEFAULT_BATCH_ROWS):
+    """
+    Stream the rows of tables to path in batches of batch_rows. The file is
+    written under a temporary name and moved into place once complete.
+    Returns the number of rows written.
+    """
+    metrics = get_metrics()
+    fmt = fmt or format_for_path(path)
+    tmp_path = path + '.tmp'
+    writer = open_writer(tmp_path, fmt)
+    written = 0
+    try:
+        batch = []
+        for record in iter_table_rows(tables):
+            batch.append(record)
+            if len(batch) >= batch_rows:
+                with metrics.stage('export'):
+                    writer.write_batch(batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            with metrics.stage('export'):
+                writer.write_batch(batch)
+            written += len(batch)
+    except BaseException:
+        writer.close()
+        os.remove(tmp_path)
+        raise
+    writer.close()
+    os.replace(tmp_path, path)
+    metrics.add('rows_exported', written)
+    return written
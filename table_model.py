@@ -0,0 +1,109 @@
+"""
+Table model
+Places cells into a rectangular grid in one pass, honouring colspan and
+rowspan, so downstream code can use rows as-is instead of padding them again.
+"""
+
+from collections import deque
+
+# Text used for positions covered by a span or missing from a short row
+FILLER = ''
+
+
+class TableGrid(list):
+    """
+    A table as a list of equal-length row lists (so it still works anywhere
+    plain row lists do), plus its width.
+    """
+
+    def __init__(self, rows=(), width=None):
+        super().__init__(rows)
+        self.width = max((len(row) for row in self), default=0) if width is None else width
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Wrap row lists (e.g. from the cache or Docs API), padding short rows in place"""
+        if isinstance(rows, cls):
+            return rows
+        grid = cls(rows)
+        for row in grid:
+            if len(row) < grid.width:
+                row.extend([FILLER] * (grid.width - len(row)))
+        return grid
+
+
+class TableBuilder:
+    """Builds a TableGrid row by row from cells and their spans"""
+
+    def __init__(self):
+        self.rows = []
+        self.width = 0
+        # Bitmaps of columns taken by rowspans from earlier rows; [0] is the next row
+        self._occupied = deque()
+        self._row = None
+        self._row_mask = 0
+        self._col = 0
+        self._cells = 0
+
+    def start_row(self):
+        if self._row is not None:
+            self.end_row()
+        self._row_mask = self._occupied.popleft() if self._occupied else 0
+        # Preallocate at the width seen so far; trailing gaps are already filled
+        self._row = [FILLER] * self.width
+        self._col = 0
+        self._cells = 0
+
+    def add_cell(self, text, colspan=1, rowspan=1):
+        if self._row is None:
+            self.start_row()
+        colspan = max(colspan, 1)
+        rowspan = max(rowspan, 1)
+
+        # Skip columns still covered by a rowspan from above
+        while self._row_mask >> self._col & 1:
+            self._col += 1
+
+        col = self._col
+        end = col + colspan
+        if end > len(self._row):
+            self._row.extend([FILLER] * (end - len(self._row)))
+        self._row[col] = text
+        self._col = end
+        self._cells += 1
+
+        if rowspan > 1:
+            mask = ((1 << colspan) - 1) << col
+            while len(self._occupied) < rowspan - 1:
+                self._occupied.append(0)
+            for k in range(rowspan - 1):
+                self._occupied[k] |= mask
+
+    def end_row(self):
+        if self._row is None:
+            return
+        if self._cells:  # Only add non-empty rows
+            # Columns held by rowspans can reach past the last cell placed
+            covered = self._row_mask.bit_length()
+            if covered > len(self._row):
+                self._row.extend([FILLER] * (covered - len(self._row)))
+            self.rows.append(self._row)
+            self.width = max(self.width, len(self._row))
+        self._row = None
+
+    def finish(self):
+        """Close the table and return it as a TableGrid"""
+        self.end_row()
+        # Rows finished before the table reached its final width
+        for row in self.rows:
+            if len(row) < self.width:
+                row.extend([FILLER] * (self.width - len(row)))
+        return TableGrid(self.rows, self.width)
+
+
+def span_value(value):
+    """Parse a colspan / rowspan attribute, treating junk and 0 as 1"""
+    try:
+        return max(int(value or 1), 1)
+    except (TypeError, ValueError):
+        return 1